@@ -0,0 +1,389 @@
+# modules/async_serial.py
+
+import asyncio
+import io
+import os
+import time
+import serial
+
+from modules.frame_bus import Frame
+from modules.frame_codec import FrameReassembler, encode_command, encode_frame, encode_frames
+from modules.command_pipeline import CommandPipeline, CommandTimeout, expected_response_kind
+from modules.keepalive import KeepAliveScheduler
+from modules.serial_handler import SerialHandler
+from modules.serial_metrics import SerialMetrics
+
+
+class SerialFrameProtocol(asyncio.Protocol):
+    """
+    asyncio protocol that feeds received bytes through the shared frame
+    reassembler and hands complete frames to its AsyncSerialHandler.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.handler.handle_incoming_data(data, time.monotonic_ns())
+
+    def connection_lost(self, exc):
+        self.handler.handle_disconnect(exc)
+
+
+class _PolledSerialTransport(asyncio.Transport):
+    """
+    Fallback transport for platforms where the port has no selectable fd
+    (Windows). Reads are polled from the event loop with a zero timeout, so
+    it still needs no thread per port.
+    """
+
+    POLL_INTERVAL = 0.002
+
+    def __init__(self, loop, connection, protocol):
+        super().__init__()
+        self._loop = loop
+        self._connection = connection
+        self._protocol = protocol
+        self._closing = False
+        self._task = loop.create_task(self._poll())
+        loop.call_soon(protocol.connection_made, self)
+
+    async def _poll(self):
+        exc = None
+        try:
+            while not self._closing:
+                waiting = self._connection.in_waiting
+                if waiting:
+                    self._protocol.data_received(self._connection.read(waiting))
+                else:
+                    await asyncio.sleep(self.POLL_INTERVAL)
+        except Exception as e:
+            exc = e
+        finally:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._protocol.connection_lost(exc)
+
+    def write(self, data):
+        self._connection.write(data)  # write_timeout=0: never blocks
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        self._closing = True
+
+
+class AsyncSerialHandler:
+    """
+    asyncio backend for a single MAKCU port.
+
+    Reads arrive through an asyncio.Protocol attached to the port's file
+    descriptor, so one event loop can drive dozens of ports without a thread
+    per port: there is no reader, writer, monitor or timeout thread, and
+    command deadlines and keep-alive probes run as tasks on the loop.
+    Framing is the same as SerialHandler (frame_codec, with read timestamps
+    and SerialMetrics), commands are correlated by the same CommandPipeline,
+    and frames that answer no command come out of the async iterator frames()
+    as frame_bus Frame objects.
+
+    The write_to_serial* methods and send_command_threadsafe() keep the
+    synchronous API usable from other threads such as the Tk main loop.
+    """
+
+    def __init__(self, logger, loop=None, frame_queue_size=1024,
+                 command_timeout=SerialHandler.COMMAND_TIMEOUT,
+                 keepalive_idle=SerialHandler.KEEPALIVE_IDLE,
+                 keepalive_deadline=SerialHandler.KEEPALIVE_DEADLINE):
+        self.logger = logger
+        self.loop = loop
+        self.com_port = ""
+        self.com_speed = 115200
+        self.current_mode = "Normal"
+        self.is_connected = False
+        self.serial_connection = None
+        self.reassembler = FrameReassembler()
+        # Deadlines are enforced with asyncio.wait_for, so no timeout thread
+        self.pipeline = CommandPipeline(default_timeout=command_timeout, use_reaper=False)
+        self.metrics = SerialMetrics()
+        self.keepalive = KeepAliveScheduler(
+            idle_interval=keepalive_idle,
+            dead_after=keepalive_deadline,
+            probe_timeout=command_timeout
+        )
+        self.frame_queue_size = frame_queue_size
+        self.frame_queue = None
+        self.dropped_frames = 0
+        self._transport = None
+        self._write_transport = None
+        self._keepalive_task = None
+        self._closed = None
+
+    async def open(self, com_port, baudrate=115200, mode="Normal"):
+        """
+        Opens com_port and attaches it to the running event loop. In Normal
+        mode an idle link is probed with km.version() like SerialHandler does.
+        """
+        self.loop = self.loop or asyncio.get_running_loop()
+        self.serial_connection = serial.Serial(
+            port=com_port,
+            baudrate=baudrate,
+            timeout=0,
+            write_timeout=0,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS
+        )
+        self._closed = self.loop.create_future()
+        self.frame_queue = asyncio.Queue(maxsize=self.frame_queue_size)
+        self.reassembler.reset()
+        if self.metrics.com_port != com_port:
+            self.metrics = SerialMetrics(com_port)
+        protocol = SerialFrameProtocol(self)
+        try:
+            fd = self.serial_connection.fileno()
+        except (AttributeError, io.UnsupportedOperation, OSError):
+            fd = None  # Windows: no selectable handle
+        if fd is not None:
+            self._transport, _ = await self.loop.connect_read_pipe(lambda: protocol, self.serial_connection)
+            # A separate fd for the write side so each transport owns its own file
+            writer = os.fdopen(os.dup(fd), "wb", buffering=0)
+            self._write_transport, _ = await self.loop.connect_write_pipe(asyncio.Protocol, writer)
+        else:
+            self._transport = _PolledSerialTransport(self.loop, self.serial_connection, protocol)
+            self._write_transport = self._transport
+        self.com_port = com_port
+        self.com_speed = baudrate
+        self.current_mode = mode
+        self.is_connected = True
+        self.metrics.connects += 1
+        self.keepalive.reset()
+        if mode == "Normal":  # The ROM bootloader in Flash mode does not answer km.version()
+            self._keepalive_task = self.loop.create_task(self._keepalive_loop())
+
+    async def close(self):
+        """Closes the port and waits until the read side has shut down."""
+        if self._transport:
+            self._transport.close()
+            await self._closed
+        self._release_transports()
+
+    def _release_transports(self):
+        write_transport, self._write_transport = self._write_transport, None
+        if write_transport and write_transport is not self._transport and not write_transport.is_closing():
+            write_transport.close()  # Also closes the duplicated write fd
+        self._transport = None
+
+    def handle_incoming_data(self, data, timestamp_ns=None):
+        """Called by the protocol on the event loop for every received chunk."""
+        self.keepalive.note_rx()
+        self.metrics.note_rx(len(data))
+        try:
+            self.reassembler.feed(data, self.handle_frame, timestamp_ns)
+        except Exception as e:
+            self.logger.terminal_print(f"Error parsing UART frames: {e}")
+            self.reassembler.reset()
+
+    def handle_frame(self, kind, payload):
+        self.metrics.note_frame(kind)
+        self.metrics.dispatch_latency.record((time.monotonic_ns() - self.reassembler.read_ns) / 1e9)
+        command = self.pipeline.resolve(kind, payload)
+        if command:
+            self.metrics.command_rtt.record(time.monotonic() - command.sent_at)
+            return
+        if self.frame_queue.full():
+            # Slow consumer: drop the oldest frame rather than stall the reader
+            self.frame_queue.get_nowait()
+            self.dropped_frames += 1
+        self.frame_queue.put_nowait(Frame(kind, bytes(payload), self.reassembler.frame_ns))
+
+    def handle_disconnect(self, exc=None):
+        """Called once the read side is gone (close() or unplug): ends frames() and fails pending commands."""
+        was_connected = self.is_connected
+        self.is_connected = False
+        self.serial_connection = None
+        self._release_transports()
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        self.pipeline.cancel_all(ConnectionError("Device disconnected"))
+        if was_connected:
+            self.metrics.disconnects += 1
+        if self.frame_queue is not None:
+            if self.frame_queue.full():
+                self.frame_queue.get_nowait()
+            self.frame_queue.put_nowait(None)  # Ends frames()
+        if self._closed and not self._closed.done():
+            self._closed.set_result(exc)
+        if exc:
+            self.logger.terminal_print(f"Device disconnected: {exc}")
+
+    async def frames(self):
+        """
+        Async iterator over received frames that were not command responses,
+        as Frame objects (kind, payload, timestamp_ns). Ends when the port is
+        closed or unplugged.
+        """
+        queue = self.frame_queue
+        if queue is None:
+            return
+        while True:
+            frame = await queue.get()
+            if frame is None:
+                queue.put_nowait(None)  # Let other iterators finish too
+                return
+            yield frame
+
+    async def _keepalive_loop(self):
+        """Probes an idle link and drops it once nothing was received within the deadline."""
+        keepalive = self.keepalive
+        while self.is_connected:
+            await asyncio.sleep(keepalive.next_wakeup())
+            now = time.monotonic()
+            if keepalive.is_dead(now):
+                self.logger.terminal_print(
+                    f"No data from device for {keepalive.dead_after:.0f}s, closing {self.com_port}."
+                )
+                if self._transport:
+                    self._transport.close()  # connection_lost() finishes the cleanup
+                return
+            if keepalive.due(now):
+                keepalive.probe_sent(now)
+                try:
+                    await self.send_command('km.version()', timeout=keepalive.probe_timeout, tag=b"km.MAKCU")
+                except (CommandTimeout, ConnectionError):
+                    keepalive.probe_done(None)
+                else:
+                    keepalive.probe_done(time.monotonic() - keepalive.last_probe)
+
+    def write_to_serial(self, data):
+        """Same frame format as SerialHandler.write_to_serial; never blocks."""
+        self.write_to_serial_with_size(None, data)
+
+    def write_to_serial_with_size(self, size, data):
+        """Same frame format as SerialHandler.write_to_serial_with_size; never blocks."""
+        if not self._write_transport or not self.is_connected:
+            self.logger.terminal_print("Attempted to write but serial is not open.")
+            return
+        self._write(encode_frame(data, size))
+
+    def _write(self, data):
+        """Writes on the loop thread; hops over to it when called from elsewhere."""
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._write_now(data)
+        else:
+            self.loop.call_soon_threadsafe(self._write_now, data)
+
+    def _write_now(self, data):
+        transport = self._write_transport
+        if transport is None or transport.is_closing():
+            return
+        transport.write(data)
+        self.metrics.note_tx(len(data))
+
+    async def send_command(self, command, payload=b"", timeout=None, tag=None):
+        """
+        Sends a command and waits for its response (str for km. commands,
+        bytes for opcodes). Raises CommandTimeout if no response arrives.
+        """
+        return (await self.send_batch([(command, payload)], timeout=timeout, tag=tag))[0]
+
+    async def send_batch(self, commands, timeout=None, tag=None):
+        """
+        Writes several commands at once and waits for all responses. Entries
+        are commands or (command, payload) tuples; results are returned in order.
+        """
+        timeout = self.pipeline.default_timeout if timeout is None else timeout
+        futures = []
+        payloads = []
+        for entry in commands:
+            command, payload = entry if isinstance(entry, tuple) else (entry, b"")
+            futures.append(self.pipeline.register(command, expected_response_kind(command), tag, timeout))
+            payloads.append(encode_command(command, payload))
+        if not self._write_transport or not self.is_connected:
+            for future in futures:
+                self.pipeline.fail(future, ConnectionError("Serial is not open"))
+        else:
+            self._write(encode_frames(payloads))
+            self.metrics.tx_frames += len(payloads)
+
+        waiters = [asyncio.wrap_future(future) for future in futures]
+        try:
+            _, pending = await asyncio.wait(waiters, timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(futures, waiters, ConnectionError("Command cancelled"))
+            raise
+        if pending:
+            self._abandon(futures, waiters, CommandTimeout("No response within timeout"))
+            self.pipeline.timeouts += len(pending)
+            raise CommandTimeout(f"No response to {len(pending)} command(s) within {timeout}s")
+        return [waiter.result() for waiter in waiters]
+
+    def _abandon(self, futures, waiters, exc):
+        """Drops unanswered commands from the pipeline without leaving unretrieved results behind."""
+        for waiter in waiters:
+            waiter.cancel()
+        for future in futures:
+            self.pipeline.fail(future, exc)
+
+    def send_command_threadsafe(self, command, payload=b"", timeout=None):
+        """
+        For callers outside the event loop thread: schedules send_command and
+        returns a concurrent.futures.Future with the response.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.send_command(command, payload, timeout=timeout), self.loop
+        )
+
+    def get_metrics(self):
+        """Snapshot of this port's counters, like SerialHandler.get_metrics()."""
+        return self.metrics.snapshot(self.reassembler, self.pipeline)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# python -m modules.async_serial PORT [PORT ...]  — one loop, many ports
+# ─────────────────────────────────────────────────────────────────────────────
+
+async def _probe_ports(ports, count=100):
+    class _Print:
+        def terminal_print(self, message):
+            print(message)
+
+    handlers = [AsyncSerialHandler(_Print()) for _ in ports]
+    await asyncio.gather(*(handler.open(port) for handler, port in zip(handlers, ports)))
+
+    async def probe(handler):
+        replies = 0
+        start = time.perf_counter()
+        for _ in range(count):
+            try:
+                await handler.send_command('km.version()', tag=b"km.MAKCU")
+                replies += 1
+            except CommandTimeout:
+                pass
+        elapsed = time.perf_counter() - start
+        print(f"{handler.com_port}: {replies}/{count} replies, {count / elapsed:,.0f} probes/s")
+
+    await asyncio.gather(*(probe(handler) for handler in handlers))
+    await asyncio.gather(*(handler.close() for handler in handlers))
+
+
+if __name__ == "__main__":
+    import sys
+    import threading
+
+    if len(sys.argv) < 2:
+        print("usage: python -m modules.async_serial PORT [PORT ...]")
+    else:
+        asyncio.run(_probe_ports(sys.argv[1:]))
+        print(f"threads in use: {threading.active_count()}")
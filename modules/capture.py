@@ -0,0 +1,195 @@
+# modules/capture.py
+
+import mmap
+import os
+import struct
+import threading
+import time
+
+from modules.frame_codec import FrameReassembler
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Capture file format (little-endian)
+#  - File header: b"MKCAP1\0\0", u64 bytes used (header included)
+#  - Records:     u64 monotonic ns, u8 direction, u32 length, data
+# ─────────────────────────────────────────────────────────────────────────────
+
+CAPTURE_MAGIC = b"MKCAP1\0\0"
+CAPTURE_RX = 0
+CAPTURE_TX = 1
+
+_FILE_HEADER = struct.Struct("<8sQ")
+_RECORD = struct.Struct("<QBI")
+
+
+class CaptureWriter:
+    """
+    Append-only, memory-mapped capture of raw serial traffic.
+
+    Every RX chunk and TX write is stored with its direction and a
+    time.monotonic_ns() stamp. The file is grown in large steps and written
+    through an mmap, so recording a chunk is a memcpy rather than a syscall;
+    the used size is kept in the header, so a capture interrupted by a crash
+    can still be read up to the last complete record.
+    """
+
+    def __init__(self, path, grow_by=4 << 20):
+        self.path = path
+        self.grow_by = grow_by
+        self.lock = threading.Lock()  # RX and TX are recorded from different threads
+        self.records = 0
+        self._file = open(path, "w+b")
+        self._size = 0
+        self._mm = None
+        self._pos = _FILE_HEADER.size
+        self._grow(_FILE_HEADER.size)
+        _FILE_HEADER.pack_into(self._mm, 0, CAPTURE_MAGIC, self._pos)
+
+    def _grow(self, needed):
+        new_size = self._size + max(self.grow_by, needed)
+        if self._mm is not None:
+            self._mm.close()
+        self._file.truncate(new_size)
+        self._size = new_size
+        self._mm = mmap.mmap(self._file.fileno(), new_size)
+
+    def record(self, direction, data, timestamp_ns=None):
+        """Appends one chunk. data may be bytes, bytearray or memoryview."""
+        timestamp_ns = time.monotonic_ns() if timestamp_ns is None else timestamp_ns
+        length = len(data)
+        with self.lock:
+            if self._mm is None:
+                return
+            end = self._pos + _RECORD.size + length
+            if end > self._size:
+                self._grow(end - self._size)
+            _RECORD.pack_into(self._mm, self._pos, timestamp_ns, direction, length)
+            self._mm[self._pos + _RECORD.size:end] = data
+            self._pos = end
+            _FILE_HEADER.pack_into(self._mm, 0, CAPTURE_MAGIC, end)
+            self.records += 1
+
+    @property
+    def bytes_used(self):
+        return self._pos
+
+    def close(self):
+        """Flushes and trims the file to the bytes actually used."""
+        with self.lock:
+            if self._mm is None:
+                return
+            self._mm.flush()
+            self._mm.close()
+            self._mm = None
+            self._file.truncate(self._pos)
+            self._file.close()
+
+
+class CaptureReader:
+    """Iterates the records of a capture file without copying their data."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else None
+        if self._mm is None or len(self._mm) < _FILE_HEADER.size:
+            raise ValueError(f"{path} is not a capture file")
+        magic, used = _FILE_HEADER.unpack_from(self._mm, 0)
+        if magic != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        self.used = min(used, len(self._mm))
+
+    def __iter__(self):
+        """
+        Yields (timestamp_ns, direction, data). data is a memoryview into the
+        file that is only valid until the next record is requested.
+        """
+        view = memoryview(self._mm)
+        pos = _FILE_HEADER.size
+        try:
+            while pos + _RECORD.size <= self.used:
+                timestamp_ns, direction, length = _RECORD.unpack_from(self._mm, pos)
+                start = pos + _RECORD.size
+                if start + length > self.used:
+                    break  # Truncated last record
+                record = view[start:start + length]
+                try:
+                    yield timestamp_ns, direction, record
+                finally:
+                    record.release()
+                pos = start + length
+        finally:
+            view.release()
+
+    def close(self):
+        self._mm.close()
+
+
+def replay(path, on_frame, realtime=False, speed=1.0, direction=CAPTURE_RX):
+    """
+    Feeds the recorded chunks of one direction back through a FrameReassembler,
+    calling on_frame(kind, payload) exactly as the live reader would. Frames
+    keep the recorded read times (see FrameReassembler.frame_ns).
+
+    With realtime=True the original gaps between chunks are reproduced (scaled
+    by speed); otherwise chunks are replayed as fast as possible, which makes
+    this a decode benchmark on real traffic. Returns a stats dict.
+    """
+    reader = CaptureReader(path)
+    records = iter(reader)
+    reassembler = FrameReassembler()
+    chunks = 0
+    total = 0
+    first_ts = None
+    start = time.perf_counter()
+    try:
+        for timestamp_ns, record_direction, data in records:
+            if record_direction != direction:
+                continue
+            if realtime:
+                if first_ts is None:
+                    first_ts = timestamp_ns
+                delay = (timestamp_ns - first_ts) / 1e9 / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            # The live reader hands the reassembler bytes, so replay does too
+            reassembler.feed(bytes(data), on_frame, timestamp_ns)
+            chunks += 1
+            total += len(data)
+    finally:
+        records.close()
+        reader.close()
+    elapsed = time.perf_counter() - start
+    return {
+        "chunks": chunks,
+        "bytes": total,
+        "frames": reassembler.frames,
+        "resyncs": reassembler.resyncs,
+        "dropped_bytes": reassembler.dropped_bytes,
+        "elapsed": elapsed,
+        "frames_per_sec": reassembler.frames / elapsed if elapsed else 0.0,
+    }
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# python -m modules.capture <file.mkcap> [--realtime] [--print]
+# ─────────────────────────────────────────────────────────────────────────────
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("usage: python -m modules.capture <file.mkcap> [--realtime] [--print]")
+        sys.exit(2)
+    show = "--print" in sys.argv
+
+    def on_frame(kind, payload):
+        if show:
+            print(f"{kind:>4} {str(payload, 'utf-8', 'ignore')!r}")
+
+    stats = replay(sys.argv[1], on_frame, realtime="--realtime" in sys.argv)
+    print(
+        f"{stats['chunks']} chunks, {stats['bytes']} bytes, {stats['frames']} frames, "
+        f"{stats['resyncs']} resyncs in {stats['elapsed']:.3f}s "
+        f"({stats['frames_per_sec']:,.0f} frames/s)"
+    )
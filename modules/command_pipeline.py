@@ -0,0 +1,153 @@
+# modules/command_pipeline.py
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from modules.frame_codec import FRAME_KM, FRAME_DEAD
+
+
+class CommandTimeout(TimeoutError):
+    """Raised on a command future when no response arrived before its deadline."""
+
+
+def expected_response_kind(command):
+    """km. text commands are answered with km. lines, opcodes with DEAD frames."""
+    return FRAME_DEAD if isinstance(command, int) else FRAME_KM
+
+
+class PendingCommand:
+    __slots__ = ("command", "expect", "tag", "deadline", "future", "sent_at", "silent")
+
+    def __init__(self, command, expect, tag, deadline, future, silent=False):
+        self.command = command
+        self.expect = expect      # Frame kind that answers this command
+        self.tag = tag            # Optional payload prefix for tagged matching
+        self.deadline = deadline  # time.monotonic() after which it times out
+        self.future = future
+        self.sent_at = time.monotonic()
+        self.silent = silent      # Response is consumed here and not shown to the user
+
+
+class CommandPipeline:
+    """
+    Tracks commands that were written to the device but not answered yet.
+
+    Every command gets its own Future and deadline, and any number of them can
+    be outstanding at once. Responses are matched in FIFO order per frame kind;
+    commands registered with a tag only match a response whose payload starts
+    with that tag, so tagged and untagged traffic can be interleaved.
+
+    Futures are completed on the thread that calls resolve() (the serial reader)
+    or on the pipeline's timeout thread, so done-callbacks must be quick. Pass
+    use_reaper=False when the caller enforces deadlines itself (e.g. asyncio)
+    and no timeout thread should be started.
+    """
+
+    def __init__(self, default_timeout=1.0, use_reaper=True):
+        self.default_timeout = default_timeout
+        self.use_reaper = use_reaper
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._reaper = None
+        self.timeouts = 0  # Commands that expired without a response
+
+    def register(self, command, expect=FRAME_KM, tag=None, timeout=None, silent=False):
+        """
+        Registers a command before it is written and returns its Future.
+        Register first, then write, so a fast response can never be missed.
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        future = Future()
+        future.set_running_or_notify_cancel()
+        entry = PendingCommand(command, expect, tag, time.monotonic() + timeout, future, silent)
+        with self._cond:
+            self._pending.append(entry)
+            if self.use_reaper:
+                self._ensure_reaper()
+            self._cond.notify()
+        return future
+
+    def resolve(self, kind, payload):
+        """
+        Completes the oldest outstanding command that matches this frame.
+        payload may be a memoryview; it is converted before being stored.
+        Returns the matched PendingCommand, or None if the frame was unsolicited.
+        """
+        with self._cond:
+            if not self._pending:
+                return None
+            for entry in self._pending:
+                if entry.expect != kind:
+                    continue
+                if entry.tag is not None and bytes(payload[:len(entry.tag)]) != entry.tag:
+                    continue
+                self._pending.remove(entry)
+                break
+            else:
+                return None
+        if kind == FRAME_KM:
+            result = str(payload, "utf-8", "ignore")
+        else:
+            result = bytes(payload)
+        if not entry.future.done():
+            entry.future.set_result(result)
+        return entry
+
+    def fail(self, future, exc):
+        """Removes a single command (e.g. its write failed) and fails its Future."""
+        with self._cond:
+            for entry in self._pending:
+                if entry.future is future:
+                    self._pending.remove(entry)
+                    break
+        if not future.done():
+            future.set_exception(exc)
+
+    def cancel_all(self, exc):
+        """Fails every outstanding command, e.g. when the port goes away."""
+        with self._cond:
+            entries = list(self._pending)
+            self._pending.clear()
+        for entry in entries:
+            if not entry.future.done():
+                entry.future.set_exception(exc)
+
+    def expire(self, now=None):
+        """Fails every command whose deadline has passed. Returns how many expired."""
+        now = time.monotonic() if now is None else now
+        with self._cond:
+            expired = [entry for entry in self._pending if entry.deadline <= now]
+            for entry in expired:
+                self._pending.remove(entry)
+            self.timeouts += len(expired)
+        for entry in expired:
+            if not entry.future.done():
+                entry.future.set_exception(
+                    CommandTimeout(f"No response to {entry.command!r} within timeout")
+                )
+        return len(expired)
+
+    @property
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _ensure_reaper(self):
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap_loop, daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        """Sleeps until the nearest deadline, expires, and exits when idle."""
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._reaper = None
+                    return
+                delay = min(entry.deadline for entry in self._pending) - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+            self.expire()
@@ -0,0 +1,337 @@
+# modules/device_db.py
+
+import bisect
+import json
+import os
+import threading
+import time
+import zlib
+
+from modules.port_inventory import normalize_usb_id
+
+
+class DeviceIndex:
+    """
+    Lookup tables over one version of the database. Built once per file
+    version and never modified, so readers need no lock: a reload builds a
+    new index and swaps it in.
+    """
+
+    __slots__ = ("by_id", "by_vendor", "entries", "_names")
+
+    def __init__(self, entries, base=None):
+        if base is None:
+            self.by_id = {}      # (vid, pid) -> entry
+            self.by_vendor = {}  # vid -> [entry, ...]
+        else:
+            self.by_id = dict(base.by_id)
+            self.by_vendor = dict(base.by_vendor)  # Vendor lists are copied when they change
+        changed_vendors = set()
+        for entry in entries:
+            try:
+                key = (int(entry["vid"], 16), int(entry["pid"], 16))  # Fast path: hex strings
+            except (KeyError, TypeError, ValueError):
+                key = (normalize_usb_id(entry.get("vid")), normalize_usb_id(entry.get("pid")))
+                if None in key:
+                    continue  # Malformed entry
+            if key in self.by_id:
+                continue  # Duplicate: the first entry wins
+            self.by_id[key] = entry
+            if base is not None and key[0] not in changed_vendors:
+                changed_vendors.add(key[0])
+                self.by_vendor[key[0]] = list(self.by_vendor.get(key[0], ()))
+            self.by_vendor.setdefault(key[0], []).append(entry)
+        self.entries = list(self.by_id.values())
+        self._names = None
+
+    def extended(self, entries):
+        """A new index with entries added after this one's; this one is left untouched."""
+        return DeviceIndex(entries, base=self)
+
+    @property
+    def names(self):
+        """Sorted (lowercase name, position) pairs for bisect prefix search, built on first use."""
+        if self._names is None:
+            self._names = sorted(
+                (str(entry.get("name", "")).lower(), i) for i, entry in enumerate(self.entries)
+            )
+        return self._names
+
+
+class DeviceDB:
+    """
+    The local USB ID database (device_db.json), loaded once and indexed by
+    (vid, pid), by vendor and by name prefix.
+
+    The file is parsed on first use only. After that, lookups check the
+    file's mtime and size at most every check_interval seconds and re-index
+    when it changed, so an edited or updated database is picked up without
+    a restart while normal lookups cost one dict hit. The file may be a list
+    of entries or {"devices": [...]}; each entry has hex "vid" / "pid"
+    strings like devices.json.
+
+    Reloads are incremental when entries were only appended to the list:
+    the bytes read last time are checked against a CRC, only the new
+    entries after the old end of the list are parsed, and the index is
+    extended instead of rebuilt. A file that shrank or changed anywhere
+    before the old end is loaded in full.
+    """
+
+    def __init__(self, path, check_interval=1.0, clock=time.monotonic):
+        self.path = path
+        self.check_interval = check_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.index = None
+        self.signature = None   # (mtime_ns, size) of the loaded file; None if it was missing
+        self.checked_at = None
+        self.loads = 0
+        self.incremental_loads = 0
+        self.last_changes = None  # (added, removed, changed) entries in the last reload
+        self.list_end = None      # Byte offset just past the list's last entry (None: no incremental reload)
+        self.list_crc = 0         # CRC-32 of the file up to list_end
+        self.list_suffix = b""    # What followed the ']' (e.g. b"]}"), whitespace removed
+        self.list_count = 0       # Entries in the file's list, malformed and duplicate ones included
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _current(self):
+        """Returns the index, loading or reloading it first if the file changed."""
+        now = self.clock()
+        if self.index is not None and now - self.checked_at < self.check_interval:
+            return self.index
+        with self.lock:
+            if self.index is not None and now - self.checked_at < self.check_interval:
+                return self.index
+            signature = self._stat()
+            self.checked_at = now
+            if self.index is None or signature != self.signature:
+                self._load(signature)
+        return self.index
+
+    def _load(self, signature):
+        raw = None
+        if signature is not None:
+            try:
+                with open(self.path, 'rb') as f:
+                    raw = f.read()
+            except OSError:
+                if self.index is not None:
+                    return
+        if raw is not None and self.index is not None and self._load_appended(raw):
+            self.signature = signature
+            return
+        entries = []
+        data = None
+        if raw is not None:
+            try:
+                data = json.loads(raw)
+                entries = data.get("devices", []) if isinstance(data, dict) else data
+            except ValueError:
+                if self.index is not None:
+                    return  # Keep serving the last good version, e.g. while the file is being written
+        index = DeviceIndex(entries)
+        if self.index is not None:
+            old, new = self.index.by_id, index.by_id
+            self.last_changes = (
+                sum(1 for key in new if key not in old),
+                sum(1 for key in old if key not in new),
+                sum(1 for key, entry in new.items() if key in old and old[key] != entry),
+            )
+        self._mark_list_end(raw, data, entries)
+        self.index = index
+        self.signature = signature
+        self.loads += 1
+
+    def _mark_list_end(self, raw, data, entries):
+        """Remembers where the entry list ends, so appended entries can be parsed alone."""
+        self.list_end = None
+        if raw is None or not isinstance(entries, list):
+            return
+        body = raw.rstrip()
+        suffix = b""
+        if isinstance(data, dict):
+            if list(data)[-1] != "devices" or not body.endswith(b"}"):
+                return  # Another key follows the list
+            body = body[:-1].rstrip()
+            suffix = b"}"
+        if not body.endswith(b"]"):
+            return
+        self.list_end = len(body[:-1].rstrip())  # Indentation before ']' moves when entries are added
+        self.list_crc = zlib.crc32(memoryview(raw)[:self.list_end])
+        self.list_suffix = b"]" + suffix
+        self.list_count = len(entries)
+
+    def _load_appended(self, raw):
+        """
+        Extends the index with entries appended after the old end of the list.
+        Returns False when the file was changed in any other way.
+        """
+        end = self.list_end
+        if end is None or self.signature is None or len(raw) < self.signature[1]:
+            return False  # Shrunk: something was removed
+        if zlib.crc32(memoryview(raw)[:end]) != self.list_crc:
+            return False  # Rewritten before the old end of the list
+        try:
+            tail = raw[end:].decode("utf-8")
+        except UnicodeDecodeError:
+            return False
+        decoder = json.JSONDecoder()
+        added = []
+        pos = last = 0
+        length = len(tail)
+        while True:
+            while pos < length and tail[pos].isspace():
+                pos += 1
+            if tail.startswith("]", pos):
+                break
+            if added or self.list_count:
+                if not tail.startswith(",", pos):
+                    return False
+                pos += 1
+                while pos < length and tail[pos].isspace():
+                    pos += 1
+            try:
+                entry, pos = decoder.raw_decode(tail, pos)
+            except ValueError:
+                return False
+            if not isinstance(entry, dict):
+                return False
+            added.append(entry)
+            last = pos
+        if "".join(tail[pos:].split()).encode() != self.list_suffix:
+            return False  # Something changed after the list
+        new_end = end + len(tail[:last].encode("utf-8"))
+        self.list_crc = zlib.crc32(memoryview(raw)[end:new_end], self.list_crc)
+        self.list_end = new_end
+        self.list_count += len(added)
+        before = len(self.index.by_id)
+        self.index = self.index.extended(added)
+        self.last_changes = (len(self.index.by_id) - before, 0, 0)
+        self.incremental_loads += 1
+        return True
+
+    def reload(self):
+        """Re-reads the file now, whether or not it changed."""
+        with self.lock:
+            self.checked_at = self.clock()
+            self._load(self._stat())
+
+    def __len__(self):
+        return len(self._current().entries)
+
+    def lookup(self, vid, pid):
+        """The entry for a VID/PID (ints or hex strings), or None."""
+        return self._current().by_id.get((normalize_usb_id(vid), normalize_usb_id(pid)))
+
+    def vendor(self, vid):
+        """Every entry of one vendor, in file order."""
+        return list(self._current().by_vendor.get(normalize_usb_id(vid), ()))
+
+    def search(self, prefix, limit=50):
+        """Entries whose name starts with prefix (case-insensitive), in name order."""
+        index = self._current()
+        prefix = prefix.lower()
+        start = bisect.bisect_left(index.names, (prefix,))
+        found = []
+        for name, i in index.names[start:start + limit]:
+            if not name.startswith(prefix):
+                break
+            found.append(index.entries[i])
+        return found
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# python -m modules.device_db bench [COUNT]  — cold and warm lookup latency
+# python -m modules.device_db VID PID         — look up one device
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _legacy_lookup(path, vid, pid):
+    """The original DeviceManager.local_db_lookup, kept for comparison."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        db = json.load(f)
+        for dev in db:
+            if dev['vid'].upper() == vid.upper() and dev['pid'].upper() == pid.upper():
+                return dev
+    return None
+
+
+def _benchmark(count=50_000, lookups=100_000):
+    import random
+    import tempfile
+
+    rng = random.Random(1)
+    ids = rng.sample(range(1 << 32), count)
+    entries = [{"vid": f"{n >> 16:04X}", "pid": f"{n & 0xFFFF:04X}", "name": f"Device {n:08X}"} for n in ids]
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "device_db.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        print(f"{count} entries, {os.path.getsize(path) / 1e6:.1f} MB")
+        probes = [rng.choice(entries) for _ in range(lookups)]
+
+        start = time.perf_counter()
+        for entry in probes[:20]:
+            _legacy_lookup(path, entry["vid"], entry["pid"])
+        legacy = (time.perf_counter() - start) / 20
+        print(f"{'legacy (load + scan per call)':<32} {legacy * 1e3:>10.2f} ms/lookup")
+
+        db = DeviceDB(path)
+        start = time.perf_counter()
+        db.lookup(probes[0]["vid"], probes[0]["pid"])
+        print(f"{'DeviceDB cold (first lookup)':<32} {(time.perf_counter() - start) * 1e3:>10.2f} ms")
+
+        start = time.perf_counter()
+        for entry in probes:
+            db.lookup(entry["vid"], entry["pid"])
+        warm = (time.perf_counter() - start) / lookups
+        print(f"{'DeviceDB warm, hex strings':<32} {warm * 1e9:>10.0f} ns/lookup")
+
+        int_probes = [(int(e["vid"], 16), int(e["pid"], 16)) for e in probes]
+        start = time.perf_counter()
+        for vid, pid in int_probes:
+            db.lookup(vid, pid)
+        warm = (time.perf_counter() - start) / lookups
+        print(f"{'DeviceDB warm, int ids':<32} {warm * 1e9:>10.0f} ns/lookup")
+
+        start = time.perf_counter()
+        for _ in range(1000):
+            db.search("device 1a")
+        print(f"{'DeviceDB name prefix search':<32} {(time.perf_counter() - start) * 1e3:>10.3f} us/query")
+
+        appended = [{"vid": "FFFF", "pid": f"{i:04X}", "name": f"Appended {i}"} for i in range(10)]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(entries + appended, f)
+        db.checked_at = -float("inf")  # Skip the check interval for the demo
+        start = time.perf_counter()
+        db.lookup(probes[0]["vid"], probes[0]["pid"])
+        print(f"{'DeviceDB reload after append':<32} {(time.perf_counter() - start) * 1e3:>10.2f} ms "
+              f"(added/removed/changed {db.last_changes})")
+
+        entries[0]["name"] = "Renamed"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        db.checked_at = -float("inf")  # Skip the check interval for the demo
+        start = time.perf_counter()
+        db.lookup(probes[0]["vid"], probes[0]["pid"])
+        print(f"{'DeviceDB reload after edit':<32} {(time.perf_counter() - start) * 1e3:>10.2f} ms "
+              f"(added/removed/changed {db.last_changes})")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:2] == ["bench"]:
+        _benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 50_000)
+    elif len(sys.argv) == 3:
+        from modules.device_manager import DEVICE_DB_PATH
+        print(DeviceDB(DEVICE_DB_PATH).lookup(sys.argv[1], sys.argv[2]))
+    else:
+        print("usage: python -m modules.device_db bench [COUNT] | VID PID")
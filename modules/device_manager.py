@@ -1,21 +1,17 @@
 import json
 import os
-import serial.tools.list_ports
 import hashlib
+from modules.device_db import DeviceDB
+from modules.device_watch import DETACHED
+from modules.port_inventory import PortInventory, normalize_usb_id
 
 DEVICES_CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'devices.json')
 DEVICE_DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'device_db.json')
 
 class DeviceManager:
     def local_db_lookup(self, vid, pid):
-        if not os.path.exists(DEVICE_DB_PATH):
-            return None
-        with open(DEVICE_DB_PATH, 'r', encoding='utf-8') as f:
-            db = json.load(f)
-            for dev in db:
-                if dev['vid'].upper() == vid.upper() and dev['pid'].upper() == pid.upper():
-                    return dev
-        return None
+        """Entry for vid/pid in the local device database (loaded once, reloaded when the file changes)."""
+        return self.device_db.lookup(vid, pid)
 
     def fetch_device_data(self, vid, pid):
         """
@@ -43,13 +39,84 @@ class DeviceManager:
 
     def test_device(self, vid, pid):
         # Simple test: check if device is connected and protocol info is correct
-        for port in serial.tools.list_ports.comports():
-            if str(port.vid).upper() == vid.upper() and str(port.pid).upper() == pid.upper():
-                return True, f"Device found on {port.device}: {port.description}"
+        port = self.inventory.first(vid, pid)
+        if port:
+            return True, f"Device found on {port.device}: {port.description}"
         return False, "Device not found on USB."
 
-    def __init__(self):
+    def __init__(self, inventory=None):
         self.devices = self.load_devices()
+        self.device_db = DeviceDB(DEVICE_DB_PATH)
+        self.profiles = {}  # (vid, pid) as ints -> device profile
+        self.index_devices()
+        self.inventory = None
+        self.connected = {}  # port -> connected-device entry, kept current by port events
+        self.attach_inventory(inventory or PortInventory())
+
+    def attach_inventory(self, inventory):
+        """
+        Serves port lookups from a shared PortInventory and follows its
+        hotplug events, so the device lists are updated per changed port
+        instead of enumerating on every call.
+        """
+        if self.inventory is not None:
+            self.inventory.remove_listener(self.handle_port_event)
+        self.inventory = inventory
+        inventory.add_listener(self.handle_port_event)
+        self.connected = {}
+        if inventory.live:
+            for port in inventory.ports():
+                self._port_attached(port)
+
+    def handle_port_event(self, event):
+        """PortInventory listener: only the port that changed is matched against the profiles."""
+        if event.action == DETACHED:
+            self.connected.pop(event.device, None)
+        else:
+            self._port_attached(event.info)
+
+    def _port_attached(self, port):
+        entry = self._match_port(port)
+        if entry:
+            self.connected[port.device] = entry
+        else:
+            self.connected.pop(port.device, None)
+
+    @staticmethod
+    def profile_key(dev):
+        """
+        (vid, pid) of a profile as 16-bit ints, the same form as pyserial's
+        port.vid / port.pid. None if either id is missing or invalid.
+        """
+        vid = normalize_usb_id(dev.get('vid'))
+        pid = normalize_usb_id(dev.get('pid'))
+        if vid is None or pid is None or not (0 <= vid <= 0xFFFF and 0 <= pid <= 0xFFFF):
+            return None
+        return vid, pid
+
+    def index_devices(self):
+        """
+        Rebuilds the (vid, pid) -> profile table. Matching a port is then a
+        single dict lookup on the port's integer ids. When two profiles share
+        an id pair, the first one in devices.json wins, as before.
+        """
+        profiles = {}
+        for dev in self.devices:
+            key = self.profile_key(dev)
+            if key is not None:
+                profiles.setdefault(key, dev)
+        self.profiles = profiles
+
+    def _match_port(self, port):
+        dev = self.profiles.get((port.vid, port.pid))
+        if dev is None:
+            return None
+        return {
+            'name': dev['name'],
+            'port': port.device,
+            'features': dev.get('features', []),
+            'serial_protocol': dev.get('serial_protocol', 'standard')
+        }
 
     def load_devices(self):
         if not os.path.exists(DEVICES_CONFIG_PATH):
@@ -63,36 +130,86 @@ class DeviceManager:
             json.dump({'devices': self.devices}, f, indent=2)
 
     def find_connected_devices(self):
+        if self.inventory.live:
+            return list(self.connected.values())
         found = []
-        ports = serial.tools.list_ports.comports()
-        for port in ports:
-            for dev in self.devices:
-                if str(port.vid).upper() == dev['vid'].upper() and str(port.pid).upper() == dev['pid'].upper():
-                    found.append({
-                        'name': dev['name'],
-                        'port': port.device,
-                        'features': dev.get('features', []),
-                        'serial_protocol': dev.get('serial_protocol', 'standard')
-                    })
+        for port in self.inventory.ports():
+            entry = self._match_port(port)
+            if entry:
+                found.append(entry)
         return found
 
     def detect_unknown_devices(self):
         unknown = []
-        ports = serial.tools.list_ports.comports()
-        known_vid_pid = {(dev['vid'].upper(), dev['pid'].upper()) for dev in self.devices}
-        for port in ports:
-            vid = str(port.vid).upper() if port.vid else None
-            pid = str(port.pid).upper() if port.pid else None
-            if vid and pid and (vid, pid) not in known_vid_pid:
-                unknown.append({'vid': vid, 'pid': pid, 'port': port.device, 'description': port.description})
+        for port in self.inventory.ports():
+            if port.vid is not None and port.pid is not None and (port.vid, port.pid) not in self.profiles:
+                # Hex, as in devices.json, so the ids can be copied into a new profile
+                unknown.append({'vid': f"{port.vid:04X}", 'pid': f"{port.pid:04X}",
+                                'port': port.device, 'description': port.description})
         return unknown
 
     def add_device(self, device_info):
         self.devices.append(device_info)
         self.save_devices()
+        key = self.profile_key(device_info)
+        if key is not None:
+            self.profiles.setdefault(key, device_info)
+        if self.inventory.live:
+            for port in self.inventory.ports():
+                self._port_attached(port)
+
+def _benchmark_matching(profile_count=10_000, port_count=64, repeat=5):
+    """Nested string matching (before) against the (vid, pid) table, on synthetic data."""
+    import random
+    import time
+    from types import SimpleNamespace
+
+    rng = random.Random(1)
+    ids = rng.sample(range(1 << 32), profile_count)
+    devices = [{'name': f"dev{i}", 'vid': f"{n >> 16:04X}", 'pid': f"{n & 0xFFFF:04X}"}
+               for i, n in enumerate(ids)]
+    # Half of the ports belong to known profiles, the other half are unknown
+    port_ids = rng.sample(ids, port_count // 2) + [rng.getrandbits(32) for _ in range(port_count - port_count // 2)]
+    ports = [SimpleNamespace(device=f"COM{i}", vid=n >> 16, pid=n & 0xFFFF, description="")
+             for i, n in enumerate(port_ids)]
+
+    def nested():
+        # The original loop, with the hex fix applied so both find the same devices
+        found = []
+        for port in ports:
+            for dev in devices:
+                if f"{port.vid:04X}" == dev['vid'].upper() and f"{port.pid:04X}" == dev['pid'].upper():
+                    found.append(dev['name'])
+        return found
+
+    manager = DeviceManager.__new__(DeviceManager)
+    manager.devices = devices
+    start = time.perf_counter()
+    manager.index_devices()
+    index_time = time.perf_counter() - start
+
+    def indexed():
+        return [entry['name'] for entry in map(manager._match_port, ports) if entry]
+
+    assert sorted(nested()) == sorted(indexed())
+    print(f"{profile_count} profiles x {port_count} ports, {len(indexed())} matches, best of {repeat}")
+    print(f"{'index build':<26} {index_time * 1e3:>10.2f} ms (once per load)")
+    for label, func in (("nested string loop (before)", nested), ("(vid, pid) table", indexed)):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        print(f"{label:<26} {best * 1e3:>10.3f} ms per scan")
+
 
 # Example usage:
 if __name__ == '__main__':
-    manager = DeviceManager()
-    print('Known devices:', manager.find_connected_devices())
-    print('Unknown devices:', manager.detect_unknown_devices())
+    import sys
+
+    if sys.argv[1:] == ['bench']:
+        _benchmark_matching()
+    else:
+        manager = DeviceManager()
+        print('Known devices:', manager.find_connected_devices())
+        print('Unknown devices:', manager.detect_unknown_devices())
@@ -0,0 +1,153 @@
+# modules/device_registry.py
+
+import json
+import os
+import threading
+import time
+
+
+def device_identity(port):
+    """
+    Stable key for the device behind a pyserial ListPortInfo, independent of
+    its COM port name: the USB serial number if it has one, else the
+    physical location (hub path), else VID:PID. Port names are the last
+    resort, for ports with no USB details at all.
+    """
+    if port.serial_number:
+        return f"sn:{port.serial_number}"
+    if port.location:
+        return f"loc:{port.location}"
+    if port.vid is not None:
+        return f"id:{port.vid:04X}:{port.pid:04X}"
+    return f"port:{port.device}"
+
+
+class DeviceRegistry:
+    """
+    Known devices and their last state (firmware, preferred baud rate, last
+    RTT, ...), keyed by device_identity() so a device keeps its context when
+    a hub re-enumerates it under another port name.
+
+    State lives in memory; the file is an append-only journal of JSON lines,
+    one per change, holding only the fields that changed. Loading replays
+    it, and it is rewritten compacted once it grows well past the number of
+    devices. note() changes memory only (for values that update often, such
+    as RTT); flush() journals whatever note() left pending.
+    """
+
+    COMPACT_MIN_LINES = 500  # Journals shorter than this are never compacted
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.lock = threading.RLock()
+        self.devices = {}     # key -> record dict
+        self.dirty = {}       # key -> fields changed by note() and not journaled yet
+        self.journal_lines = 0
+        self.loaded = False
+
+    # ── Persistence ──────────────────────────────────────────────────────────
+
+    def load(self):
+        """Replays the journal (once). Later calls are no-ops."""
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            if not os.path.exists(self.path):
+                return
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        self.journal_lines += 1
+                        try:
+                            change = json.loads(line)
+                        except ValueError:
+                            continue  # A torn last line from a crash; the rest is still good
+                        key = change.pop("key", None)
+                        if key:
+                            self.devices.setdefault(key, {"key": key}).update(change)
+            except OSError:
+                pass
+
+    def _append(self, lines):
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write("".join(lines))
+            self.journal_lines += len(lines)
+        except OSError:
+            return
+        if self.journal_lines > max(self.COMPACT_MIN_LINES, 4 * len(self.devices)):
+            self.compact()
+
+    def compact(self):
+        """Rewrites the journal as one line per device (atomically)."""
+        with self.lock:
+            temp_path = self.path + ".tmp"
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    for record in self.devices.values():
+                        f.write(json.dumps(record) + "\n")
+                os.replace(temp_path, self.path)
+                self.journal_lines = len(self.devices)
+            except OSError:
+                pass
+
+    def flush(self):
+        """Journals the fields changed through note() since the last flush."""
+        with self.lock:
+            if not self.dirty:
+                return
+            lines = [json.dumps(dict(fields, key=key)) + "\n" for key, fields in self.dirty.items()]
+            self.dirty.clear()
+            self._append(lines)
+
+    # ── Records ──────────────────────────────────────────────────────────────
+
+    def get(self, key):
+        self.load()
+        return self.devices.get(key)
+
+    def _apply(self, key, fields):
+        """Applies fields to the record and returns only those that changed."""
+        record = self.devices.setdefault(key, {"key": key})
+        changed = {name: value for name, value in fields.items() if record.get(name) != value}
+        record.update(changed)
+        return changed
+
+    def update(self, key, **fields):
+        """Changes a device's state and journals the fields that actually changed."""
+        self.load()
+        with self.lock:
+            changed = self._apply(key, fields)
+            pending = self.dirty.pop(key, {})
+            pending.update(changed)
+            if pending:
+                self._append([json.dumps(dict(pending, key=key)) + "\n"])
+            return self.devices[key]
+
+    def note(self, key, **fields):
+        """Like update(), but only in memory until the next flush()."""
+        self.load()
+        with self.lock:
+            changed = self._apply(key, fields)
+            if changed:
+                self.dirty.setdefault(key, {}).update(changed)
+            return self.devices[key]
+
+    def attach(self, port):
+        """
+        Records that the device behind port (a ListPortInfo) was connected,
+        and returns its record with whatever state was known from before.
+        """
+        key = device_identity(port)
+        self.load()
+        with self.lock:
+            record = self.devices.get(key, {})
+            return self.update(
+                key,
+                vid=port.vid, pid=port.pid,
+                serial_number=port.serial_number, location=port.location,
+                com_port=port.device, last_seen=int(self.clock()),
+                connects=record.get("connects", 0) + 1,
+            )
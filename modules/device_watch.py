@@ -0,0 +1,204 @@
+# modules/device_watch.py
+
+import glob
+import os
+import sys
+import threading
+import time
+
+import serial.tools.list_ports
+
+try:
+    import pyudev  # Optional: kernel hotplug events on Linux
+except ImportError:
+    pyudev = None
+
+try:
+    import winreg
+except ImportError:
+    winreg = None
+
+ATTACHED = "attached"
+DETACHED = "detached"
+
+# Device nodes that can be serial ports, for the cheap name-only listing
+_POSIX_PORT_PATTERNS = (
+    "/dev/ttyUSB*", "/dev/ttyACM*", "/dev/ttyAMA*", "/dev/rfcomm*",  # Linux
+    "/dev/ttyXRUSB*", "/dev/ttyGS*", "/dev/ttyAP*",
+    "/dev/cu.*",                                                      # macOS
+)
+_WINDOWS_SERIALCOMM = r"HARDWARE\DEVICEMAP\SERIALCOMM"
+
+
+class PortEvent:
+    """
+    One attach or detach. info is the pyserial ListPortInfo of the port
+    (for a detach, as it was while attached), so listeners can read
+    vid, pid, serial_number, location and hwid without enumerating again.
+    """
+
+    __slots__ = ("action", "device", "info", "timestamp")
+
+    def __init__(self, action, device, info, timestamp=None):
+        self.action = action
+        self.device = device
+        self.info = info
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+
+    def __repr__(self):
+        return f"PortEvent({self.action!r}, {self.device!r})"
+
+
+def list_port_names():
+    """
+    Names of the serial ports present right now, without reading any
+    per-port metadata. This is what the polling fallback runs every tick:
+    a directory glob on POSIX and one registry key on Windows, instead of
+    comports(), which reads sysfs / SetupAPI for every port.
+    Returns None where no cheap listing exists.
+    """
+    if winreg is not None:
+        try:
+            key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, _WINDOWS_SERIALCOMM)
+        except OSError:
+            return frozenset()  # The key only exists while some port is present
+        names = set()
+        try:
+            for i in range(winreg.QueryInfoKey(key)[1]):
+                names.add(winreg.EnumValue(key, i)[1])
+        finally:
+            winreg.CloseKey(key)
+        return frozenset(names)
+    if os.name == "posix":
+        return frozenset(path for pattern in _POSIX_PORT_PATTERNS for path in glob.glob(pattern))
+    return None
+
+
+class DeviceWatcher:
+    """
+    Tracks attached serial ports and pushes PortEvents to listeners.
+
+    On Linux with pyudev installed, the watcher blocks on udev (netlink)
+    events for the tty subsystem, so a plug-in is seen within milliseconds
+    and an idle host does no work at all. Otherwise it polls the cheap
+    name-only listing every poll_interval seconds. In both cases comports()
+    runs only when something actually changed, and listeners get just the
+    difference.
+
+    Listeners are called on the watcher's thread and must be quick; ports
+    holds the current {device: ListPortInfo} snapshot and can be read from
+    any thread.
+    """
+
+    def __init__(self, poll_interval=1.0, use_udev=True):
+        self.poll_interval = poll_interval
+        self.use_udev = use_udev and pyudev is not None and sys.platform.startswith("linux")
+        self.ports = {}        # device -> ListPortInfo; swapped on every change, never mutated
+        self.listeners = ()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.rescans = 0       # comports() enumerations so far
+        self.changed_at = None  # time.monotonic() of the last attach/detach
+
+    @property
+    def backend(self):
+        return "udev" if self.use_udev else "poll"
+
+    def add_listener(self, callback):
+        """callback(PortEvent) is called for every attach and detach."""
+        with self.lock:
+            self.listeners += (callback,)
+
+    def remove_listener(self, callback):
+        with self.lock:
+            self.listeners = tuple(l for l in self.listeners if l != callback)
+
+    def start(self):
+        """Takes the initial snapshot (reported as attach events) and starts watching."""
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.stop_event.clear()
+        target = self._watch_udev if self.use_udev else self._watch_poll
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+            self.stop_event.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+
+    def rescan(self):
+        """Enumerates once and emits events for whatever changed. Returns the events."""
+        current = {port.device: port for port in serial.tools.list_ports.comports()}
+        self.rescans += 1
+        previous = self.ports
+        events = [PortEvent(DETACHED, device, info)
+                  for device, info in previous.items() if device not in current]
+        events += [PortEvent(ATTACHED, device, info)
+                   for device, info in current.items()
+                   if device not in previous or previous[device].hwid != info.hwid]
+        self.ports = current
+        if events:
+            self.changed_at = time.monotonic()
+        for event in events:
+            for listener in self.listeners:
+                try:
+                    listener(event)
+                except Exception:
+                    pass  # A failing listener must not stop the watcher
+        return events
+
+    def _watch_poll(self):
+        names = list_port_names()
+        self.rescan()
+        while not self.stop_event.wait(self.poll_interval):
+            if names is None:
+                self.rescan()  # No cheap listing on this platform
+                continue
+            current = list_port_names()
+            if current != names:
+                names = current
+                self.rescan()
+
+    def _watch_udev(self):
+        context = pyudev.Context()
+        monitor = pyudev.Monitor.from_netlink(context)
+        monitor.filter_by(subsystem="tty")
+        monitor.start()  # Subscribe before the first scan so no event falls in between
+        self.rescan()
+        while not self.stop_event.is_set():
+            device = monitor.poll(timeout=0.5)
+            if device is None or device.action not in ("add", "remove"):
+                continue
+            while monitor.poll(timeout=0) is not None:
+                pass  # One rescan covers a burst of events (e.g. a hub coming up)
+            self.rescan()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# python -m modules.device_watch — prints attach/detach events until Ctrl+C
+# ─────────────────────────────────────────────────────────────────────────────
+
+if __name__ == "__main__":
+    watcher = DeviceWatcher()
+
+    def show(event):
+        info = event.info
+        print(f"{event.action:9} {event.device}  {info.hwid}  {info.description}")
+
+    watcher.add_listener(show)
+    watcher.start()
+    print(f"Watching serial ports ({watcher.backend}), Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
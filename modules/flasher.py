@@ -2,7 +2,6 @@ import requests
 import threading
 import os
 import subprocess
-import time
 import sys
 from modules.utils import get_download_path, get_icon_path
 
@@ -162,12 +161,9 @@ class Flasher:
             self.serial_handler.set_flashing(True)
             self.logger.terminal_print(f"Loaded file: {bin_path}")
 
-            if self.serial_handler.is_connected:
-                self.serial_handler.stop_monitoring()
-                if self.serial_handler.monitoring_thread and self.serial_handler.monitoring_thread.is_alive():
-                    self.serial_handler.monitoring_thread.join(timeout=5)
-
-            time.sleep(0.5)
+            # Borrow the port: the handler's threads pause and the handle is
+            # closed so esptool can open it; it is reopened directly afterwards.
+            lease = self.serial_handler.acquire_port("flasher")
 
             process_failed = False
             process = None
@@ -178,7 +174,7 @@ class Flasher:
                 esptool_args = [
                     self.esptool_path,
                     '--chip', 'esp32s3',
-                    '--port', self.serial_handler.com_port,
+                    '--port', lease.com_port,
                     '--baud', '921600',
                     'write_flash', '0x0', bin_path
                 ]
@@ -226,6 +222,7 @@ class Flasher:
 
                 if process.returncode == 0 or success_detected or bootloader_warning_detected:
                     self.logger.terminal_print("\nFlashing completed successfully.\n\n Please remove the usb cable\n\n Thanks for using MAKCU.")
+                    self.serial_handler.update_device_state(lease.com_port, firmware=os.path.basename(bin_path))
                 else:
                     process_failed = True
 
@@ -240,5 +237,7 @@ class Flasher:
                 if process_failed and not bootloader_warning_detected:
                     self.logger.terminal_print("Flashing encountered errors.")
                 self.is_flashing = False
+                self.serial_handler.release_port(lease)
                 self.serial_handler.set_flashing(False)
-                self.serial_handler.start_monitoring()
+                if not self.serial_handler.monitoring_active:
+                    self.serial_handler.start_monitoring()
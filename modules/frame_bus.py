@@ -0,0 +1,252 @@
+# modules/frame_bus.py
+
+import collections
+import threading
+import time
+
+from modules.frame_codec import FRAME_KM, FRAME_DEAD
+
+DROP_OLDEST = "drop_oldest"  # A full queue discards its oldest frame to make room
+DROP_NEWEST = "drop_newest"  # A full queue refuses the incoming frame
+
+
+class Frame:
+    """
+    One decoded frame as published on the bus.
+
+    payload is an immutable bytes copy, so subscribers may keep it. The text
+    form is decoded on first access of .text and cached, so binary-only
+    subscribers never pay for UTF-8 decoding.
+    """
+
+    __slots__ = ("kind", "payload", "timestamp_ns", "_text")
+
+    def __init__(self, kind, payload, timestamp_ns=None):
+        self.kind = kind
+        self.payload = payload
+        self.timestamp_ns = timestamp_ns
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = str(self.payload, 'utf-8', 'ignore')
+        return self._text
+
+    def __repr__(self):
+        return f"Frame({self.kind!r}, {self.payload!r})"
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter: up to `rate` events per second on average, with
+    bursts of up to `burst` events. take() never blocks.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def take(self, count=1):
+        """Consumes count tokens if available. Returns False when over the limit."""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < count:
+            return False
+        self.tokens -= count
+        return True
+
+
+class Channel:
+    """
+    One frame kind's stream on the bus (km. text or DEAD binary), with its
+    own subscribers and an optional rate limit for the whole stream.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.subscriptions = ()  # Swapped, never mutated, so publish needs no lock
+        self.limiter = None      # TokenBucket, or None for unlimited
+        self.published = 0
+        self.throttled = 0       # Frames refused by the channel's rate limit
+
+
+class Subscription:
+    """
+    A subscriber's bounded queue. With a callback, frames are delivered on the
+    subscription's own daemon thread; without one, the owner pulls them with
+    get(). Either way a slow subscriber only ever loses its own frames
+    (counted in dropped); it never slows down the publisher. An optional
+    rate limit (frames per second) throttles just this subscriber, e.g. the
+    terminal, while recorders on the same channel still get every frame.
+    """
+
+    def __init__(self, bus, callback=None, kinds=None, maxsize=1024, policy=DROP_OLDEST, name=None,
+                 rate=None, burst=None):
+        self.bus = bus
+        self.callback = callback
+        self.kinds = frozenset(kinds) if kinds else None  # None: every kind
+        self.maxsize = maxsize
+        self.policy = policy
+        self.name = name or getattr(callback, "__name__", "subscriber")
+        self.queue = collections.deque()
+        self.ready = threading.Condition(threading.Lock())
+        self.limiter = TokenBucket(rate, burst) if rate else None
+        self.delivered = 0
+        self.dropped = 0
+        self.throttled = 0
+        self._reported = 0  # dropped + throttled already returned by take_lost()
+        self.active = True
+        self.thread = None
+        if callback is not None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def offer(self, frame):
+        """Called by the bus on the publishing thread. Never blocks."""
+        if self.limiter is not None and not self.limiter.take():
+            self.throttled += 1
+            return
+        with self.ready:
+            if len(self.queue) >= self.maxsize:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    return
+                self.queue.popleft()
+            self.queue.append(frame)
+            self.ready.notify()
+
+    def get(self, timeout=None):
+        """Returns the next frame, or None on timeout or once the subscription is closed."""
+        with self.ready:
+            if not self.queue and self.active:
+                self.ready.wait(timeout)
+            if not self.queue:
+                return None
+            return self.queue.popleft()
+
+    @property
+    def depth(self):
+        return len(self.queue)
+
+    def take_lost(self):
+        """Frames dropped or throttled since the last call, for 'N skipped' notices."""
+        lost = self.dropped + self.throttled
+        new = lost - self._reported
+        self._reported = lost
+        return new
+
+    def close(self):
+        """Stops delivery. Frames still queued are discarded."""
+        self.bus.unsubscribe(self)
+        with self.ready:
+            self.active = False
+            self.queue.clear()
+            self.ready.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+
+    def _run(self):
+        while self.active:
+            frame = self.get()
+            if frame is None:
+                continue
+            try:
+                self.callback(frame)
+                self.delivered += 1
+            except Exception:
+                pass  # A failing subscriber must not kill its delivery thread
+
+
+class FrameBus:
+    """
+    In-process publish/subscribe bus for decoded frames.
+
+    Each frame kind has its own Channel, so km. console text and DEAD binary
+    frames reach separate consumers and can be rate limited separately:
+    a flood of binary frames cannot crowd console replies out of a shared
+    queue. The RX path publishes every frame once; the bus makes one Frame
+    (one payload copy) and hands it to each subscription on that channel.
+    When a channel has no subscribers, publishing costs a dict lookup and no
+    copy at all.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = {FRAME_KM: Channel(FRAME_KM), FRAME_DEAD: Channel(FRAME_DEAD)}
+
+    def channel(self, kind):
+        return self.channels[kind]
+
+    def set_rate_limit(self, kind, rate, burst=None):
+        """Limits a whole channel to rate frames per second (None removes the limit)."""
+        self.channels[kind].limiter = TokenBucket(rate, burst) if rate else None
+
+    def subscribe(self, callback=None, kinds=None, maxsize=1024, policy=DROP_OLDEST, name=None,
+                  rate=None, burst=None):
+        """
+        Adds a subscriber to the channels for kinds (default: all), optionally
+        limited to rate frames per second. Returns its Subscription.
+        """
+        subscription = Subscription(self, callback, kinds, maxsize, policy, name, rate, burst)
+        with self.lock:
+            for kind, channel in self.channels.items():
+                if subscription.kinds is None or kind in subscription.kinds:
+                    channel.subscriptions += (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in self.channels.values():
+                channel.subscriptions = tuple(s for s in channel.subscriptions if s is not subscription)
+
+    def has_subscribers(self, kind):
+        channel = self.channels.get(kind)
+        return bool(channel and channel.subscriptions)
+
+    @property
+    def published(self):
+        return sum(channel.published for channel in self.channels.values())
+
+    def publish(self, kind, payload, timestamp_ns=None):
+        """
+        Publishes one frame on its kind's channel. payload may be a memoryview
+        that is only valid during this call; it is copied once if anyone is
+        listening and the channel's rate limit lets it through.
+        """
+        channel = self.channels.get(kind)
+        if channel is None or not channel.subscriptions:
+            return None
+        if channel.limiter is not None and not channel.limiter.take():
+            channel.throttled += 1
+            return None
+        frame = Frame(kind, bytes(payload), timestamp_ns)
+        for subscription in channel.subscriptions:
+            subscription.offer(frame)
+        channel.published += 1
+        return frame
+
+    def stats(self):
+        """Per-channel counters and each subscriber's queue depth and losses."""
+        return {
+            kind: {
+                "published": channel.published,
+                "throttled": channel.throttled,
+                "subscribers": {
+                    s.name: {"depth": s.depth, "delivered": s.delivered,
+                             "dropped": s.dropped, "throttled": s.throttled}
+                    for s in channel.subscriptions
+                },
+            }
+            for kind, channel in self.channels.items()
+        }
+
+    def close(self):
+        with self.lock:
+            subscriptions = {s for channel in self.channels.values() for s in channel.subscriptions}
+        for subscription in subscriptions:
+            subscription.close()
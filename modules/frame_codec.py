@@ -0,0 +1,461 @@
+# modules/frame_codec.py
+
+import re
+import struct
+import time
+from array import array
+
+# ─────────────────────────────────────────────────────────────────────────────
+# UART framing used by MAKCU
+#  - Console text:  b"km." ... b"\r"
+#  - Binary frames: 0xDE 0xAD, 16-bit payload size (LSB, MSB), payload
+# ─────────────────────────────────────────────────────────────────────────────
+
+KM_HEADER = b"km."
+DEAD_HEADER = b"\xDE\xAD"
+FRAME_KM = "km"
+FRAME_DEAD = "dead"
+
+KM_MAX_LEN = 1024  # A km. line longer than this without '\r' is treated as noise
+
+_SIZE = struct.Struct("<H")
+_HEADER_RE = re.compile(re.escape(KM_HEADER) + b"|" + re.escape(DEAD_HEADER))  # Either header, one scan
+_FILLER_RE = re.compile(rb"[\r\n >]*")  # Line endings and the ">>> " prompt between frames; not noise
+_HEADER = struct.Struct("<2sH")  # 0xDE 0xAD + 16-bit size
+HEADER_LEN = _HEADER.size
+
+
+_pack_header = _HEADER.pack
+
+
+def _as_bytes(data):
+    return data.encode("utf-8") if isinstance(data, str) else data
+
+
+def _batch_format(payloads):
+    """One struct format covering a whole batch: header, size, payload per frame."""
+    return "<" + "2sH%ds" * len(payloads) % tuple(map(len, payloads))
+
+
+def _batch_args(payloads):
+    args = []
+    for data in payloads:
+        args += (DEAD_HEADER, len(data) & 0xFFFF, data)
+    return args
+
+
+def encode_frame(data, size=None):
+    """
+    Wraps data in a DEAD frame: 0xDE 0xAD, 16-bit size (LSB, MSB), data.
+    size defaults to len(data). Returns new bytes that the caller owns, so the
+    frame is safe to queue.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return _pack_header(DEAD_HEADER, (len(data) if size is None else size) & 0xFFFF) + data
+
+
+def encode_frames(payloads):
+    """
+    Vectored encode: packs many payloads into one contiguous bytes object with
+    a single struct call, ready for a single write().
+    """
+    payloads = [_as_bytes(data) for data in payloads]
+    return struct.pack(_batch_format(payloads), *_batch_args(payloads))
+
+
+def encode_command(command, payload=b""):
+    """A command is either km. text (str) or a one-byte opcode (int), plus payload."""
+    if isinstance(command, int):
+        return bytes([command]) + payload
+    return bytes(command, "utf-8") + payload
+
+
+def _partial_header_len(data, end):
+    """Number of trailing bytes in data[:end] that could start a header."""
+    if data.endswith(b"km", 0, end):
+        return 2
+    if data.endswith(b"k", 0, end) or data.endswith(b"\xDE", 0, end):
+        return 1
+    return 0
+
+
+def parse_uart_frames(data, on_frame, start=0, stats=None):
+    """
+    Parses complete frames from data (bytes or bytearray) starting at start.
+
+    on_frame(kind, payload) is called for every complete frame, where payload is
+    a memoryview slice of data (no copy). A km. payload includes the header and
+    the trailing '\\r'; a DEAD payload excludes the 4-byte header. The view is
+    only valid during the call - copy it with bytes() to keep it.
+
+    Bytes skipped between frames count as a resync in stats (if given),
+    unless they are only line endings and the ">>> " prompt.
+
+    Returns the index of the first byte that was not consumed. Everything from
+    there on is either an incomplete frame or a possible partial header and
+    must be kept for the next call.
+    """
+    length = len(data)
+    index = start
+    with memoryview(data) as view:
+        while index < length:
+            # Handle 'km.' frames
+            if data.startswith(KM_HEADER, index):
+                end_index = data.find(b"\r", index, index + KM_MAX_LEN)
+                if end_index != -1:  # Full frame found
+                    on_frame(FRAME_KM, view[index:end_index + 1])  # Include '\r'
+                    index = end_index + 1
+                    continue
+                if length - index < KM_MAX_LEN:
+                    break  # Incomplete frame, wait for more data
+                # Unterminated line: fall through and resync past it
+
+            # Handle 0xDE, 0xAD frames
+            elif data.startswith(DEAD_HEADER, index):
+                if index + 4 > length:
+                    break  # Incomplete frame header, wait for more data
+                size = _SIZE.unpack_from(data, index + 2)[0]
+                end_index = index + 4 + size
+                if end_index > length:
+                    break  # Incomplete frame, wait for more data
+                on_frame(FRAME_DEAD, view[index + 4:end_index])
+                index = end_index
+                continue
+
+            # Skip to the next potential header
+            match = _HEADER_RE.search(data, index + 1)
+            if match is None:
+                # No more headers; keep only a possible partial header
+                resync_to = max(length - _partial_header_len(data, length), index)
+                if stats is not None and not _FILLER_RE.fullmatch(data, index, resync_to):
+                    stats.resyncs += 1
+                    stats.dropped_bytes += resync_to - index
+                return resync_to
+
+            next_index = match.start()
+            if stats is not None and not _FILLER_RE.fullmatch(data, index, next_index):
+                stats.resyncs += 1
+                stats.dropped_bytes += next_index - index
+            index = next_index
+    return index
+
+
+class FrameReassembler:
+    """
+    Incremental frame parser that keeps only the unconsumed tail between reads,
+    so frames split across two serial reads are never lost.
+
+    The tail lives in a single bytearray that is trimmed in place. When there is
+    no pending tail, a fresh chunk is parsed directly without being copied.
+
+    Each chunk carries the time.monotonic_ns() at which it was read. While
+    on_frame runs, frame_ns holds the read time of the frame's first byte
+    (for a frame split across reads, the read that delivered the start of
+    the tail) and read_ns the read time of the chunk that completed it.
+    """
+
+    def __init__(self, max_pending=1 << 17):
+        self.buffer = bytearray()
+        self.max_pending = max_pending  # Upper bound for a stuck partial frame
+        self.frames = 0
+        self.resyncs = 0
+        self.dropped_bytes = 0
+        self.read_ns = 0   # Read time of the chunk being parsed
+        self.frame_ns = 0  # Read time of the current frame's first byte
+        self.tail_ns = 0   # Read time of the first byte still in buffer
+
+    def feed(self, data, on_frame, timestamp_ns=None):
+        """
+        Adds a chunk of received bytes and calls on_frame(kind, payload) for
+        every frame that is now complete. timestamp_ns is when the chunk was
+        read (default: now). Returns the number of frames parsed.
+        """
+        before = self.frames
+        if timestamp_ns is None:
+            timestamp_ns = time.monotonic_ns()
+        self.read_ns = timestamp_ns
+
+        def count(kind, payload):
+            self.frames += 1
+            on_frame(kind, payload)
+            self.frame_ns = timestamp_ns  # Only the first frame can start in the tail
+
+        if not self.buffer:
+            # Fast path: parse the chunk in place, buffer only what is left over
+            self.frame_ns = timestamp_ns
+            consumed = parse_uart_frames(data, count, stats=self)
+            if consumed < len(data):
+                self.buffer += memoryview(data)[consumed:]
+                self.tail_ns = timestamp_ns
+        else:
+            self.frame_ns = self.tail_ns
+            self.buffer += data
+            consumed = parse_uart_frames(self.buffer, count, stats=self)
+            self._discard(consumed)
+            if consumed:
+                self.tail_ns = timestamp_ns  # The old partial frame is gone
+
+        if len(self.buffer) > self.max_pending:
+            # Should never happen with valid traffic: a frame cannot exceed 64 KiB
+            self.dropped_bytes += len(self.buffer)
+            self.resyncs += 1
+            self._discard(len(self.buffer))
+        return self.frames - before
+
+    def _discard(self, count):
+        if not count:
+            return
+        try:
+            del self.buffer[:count]
+        except BufferError:
+            # A consumer kept a payload view alive; leave it its bytes
+            self.buffer = self.buffer[count:]
+
+    def reset(self):
+        """Drops any buffered partial frame (e.g. after a reconnect)."""
+        self._discard(len(self.buffer))
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Bulk offline decoding
+# ─────────────────────────────────────────────────────────────────────────────
+
+KIND_KM = 0
+KIND_DEAD = 1
+KIND_NAMES = (FRAME_KM, FRAME_DEAD)  # kinds array code -> frame kind
+
+
+class DecodedFrames:
+    """
+    Result of decode_bulk(): one entry per frame in three parallel arrays.
+
+    kinds[i] is KIND_KM or KIND_DEAD, offsets[i] / lengths[i] locate the
+    payload in the decoded buffer with the same bounds parse_uart_frames
+    would pass to on_frame. Nothing is sliced or copied until payload(i).
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.kinds = array('B')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.consumed = 0       # Bytes up to which data was decoded
+        self.resyncs = 0
+        self.dropped_bytes = 0
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        """Yields (kind, offset, length) with kind as FRAME_KM or FRAME_DEAD."""
+        for code, offset, length in zip(self.kinds, self.offsets, self.lengths):
+            yield KIND_NAMES[code], offset, length
+
+    def payload(self, i):
+        """The payload of frame i as bytes."""
+        offset = self.offsets[i]
+        return bytes(self.data[offset:offset + self.lengths[i]])
+
+    def count(self, kind):
+        return self.kinds.count(KIND_KM if kind == FRAME_KM else KIND_DEAD)
+
+
+def decode_bulk(data, start=0):
+    """
+    Decodes every complete frame in data (bytes, bytearray or mmap) without
+    callbacks or side effects. Headers are checked by byte value in place and
+    noise is skipped with a single regex search for both headers, and frames
+    are recorded as array offsets rather than slices, so multi-megabyte logs
+    decode in one pass with flat memory.
+
+    Framing rules match parse_uart_frames exactly, including resync counting.
+    Returns a DecodedFrames; its consumed field says where an incomplete
+    trailing frame (if any) begins.
+    """
+    result = DecodedFrames(data)
+    add_kind = result.kinds.append
+    add_offset = result.offsets.append
+    add_length = result.lengths.append
+    search = _HEADER_RE.search
+    filler = _FILLER_RE.fullmatch
+    find = data.find
+    unpack_size = _SIZE.unpack_from
+    length = len(data)
+    index = start
+    resyncs = 0
+    dropped = 0
+
+    while index < length:
+        byte = data[index]
+        if byte == 0x6B and index + 2 < length and data[index + 1] == 0x6D and data[index + 2] == 0x2E:
+            end_index = find(b"\r", index, index + KM_MAX_LEN)
+            if end_index != -1:
+                add_kind(KIND_KM)
+                add_offset(index)
+                add_length(end_index + 1 - index)
+                index = end_index + 1
+                continue
+            if length - index < KM_MAX_LEN:
+                break  # Incomplete trailing line
+        elif byte == 0xDE and index + 1 < length and data[index + 1] == 0xAD:
+            if index + 4 > length:
+                break
+            size = unpack_size(data, index + 2)[0]
+            end_index = index + 4 + size
+            if end_index > length:
+                break
+            add_kind(KIND_DEAD)
+            add_offset(index + 4)
+            add_length(size)
+            index = end_index
+            continue
+
+        match = search(data, index + 1)
+        if match is None:
+            # No more headers; keep only a possible partial header
+            tail = bytes(data[max(length - 2, index):length])
+            resync_to = max(length - _partial_header_len(tail, len(tail)), index)
+            if not filler(data, index, resync_to):
+                resyncs += 1
+                dropped += resync_to - index
+            index = resync_to
+            break
+        next_index = match.start()
+        if not filler(data, index, next_index):
+            resyncs += 1
+            dropped += next_index - index
+        index = next_index
+
+    result.consumed = index
+    result.resyncs = resyncs
+    result.dropped_bytes = dropped
+    return result
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Benchmarks:  python -m modules.frame_codec [decode|encode|bulk [file]]
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _build_stream(rng, count):
+    """Random mix of km. lines, DEAD frames and line noise."""
+    out = bytearray()
+    for i in range(count):
+        if rng.random() < 0.5:
+            out += b"km.MAKCU %d\n\r" % i
+        else:
+            payload = rng.randbytes(rng.randint(0, 48))
+            out += DEAD_HEADER + _SIZE.pack(len(payload)) + payload
+        if rng.random() < 0.05:
+            out += b">>> "
+    return bytes(out)
+
+
+def _fragment(rng, stream, mean_chunk):
+    """Splits stream into chunks of 1..2*mean_chunk bytes."""
+    chunks = []
+    index = 0
+    while index < len(stream):
+        size = rng.randint(1, max(2 * mean_chunk, 1))
+        chunks.append(stream[index:index + size])
+        index += size
+    return chunks
+
+
+def _benchmark_decode(frame_count=200_000, seed=1):
+    import random
+    import time
+
+    rng = random.Random(seed)
+    stream = _build_stream(rng, frame_count)
+
+    # The reference count comes from parsing the stream in one piece
+    expected = []
+    parse_uart_frames(stream, lambda kind, payload: expected.append(1))
+    expected = len(expected)
+
+    avg_frame = len(stream) / frame_count
+    print(f"{frame_count} frames, {len(stream)} bytes, {avg_frame:.1f} bytes/frame avg")
+    print(f"{'baud':>9} {'chunk':>6} {'line frames/s':>14} {'parser frames/s':>16} {'lost':>5}")
+    for baud in (115200, 921600, 2_000_000, 4_000_000):
+        line_bytes_per_sec = baud / 10  # 8N1
+        mean_chunk = max(int(line_bytes_per_sec / 1000), 1)  # ~1 ms of data per read
+        chunks = _fragment(rng, stream, mean_chunk)
+        reassembler = FrameReassembler()
+        sink = lambda kind, payload: None
+        start = time.perf_counter()
+        for chunk in chunks:
+            reassembler.feed(chunk, sink)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{baud:>9} {mean_chunk:>6} {line_bytes_per_sec / avg_frame:>14,.0f} "
+            f"{reassembler.frames / elapsed:>16,.0f} {expected - reassembler.frames:>5}"
+        )
+
+
+def _benchmark_bulk(path=None, frame_count=1_000_000, seed=1):
+    """decode_bulk over a raw UART dump (memory-mapped), or a synthetic stream."""
+    import mmap
+
+    if path:
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        label = path
+    else:
+        import random
+        data = _build_stream(random.Random(seed), frame_count)
+        label = "synthetic stream"
+    megabytes = len(data) / 1e6
+    print(f"{label}: {megabytes:.1f} MB")
+
+    start = time.perf_counter()
+    result = decode_bulk(data)
+    elapsed = time.perf_counter() - start
+    print(
+        f"decode_bulk        {len(result):>9} frames ({result.count(FRAME_KM)} km, "
+        f"{result.count(FRAME_DEAD)} dead), {result.resyncs} resyncs, "
+        f"{megabytes / elapsed:>7.1f} MB/s"
+    )
+    if not path:
+        frames = []
+        start = time.perf_counter()
+        parse_uart_frames(data, lambda kind, payload: frames.append(bytes(payload)))
+        elapsed = time.perf_counter() - start
+        print(f"parse_uart_frames  {len(frames):>9} frames (slices kept), {megabytes / elapsed:>7.1f} MB/s")
+
+
+def _legacy_encode(data):
+    """The original write_to_serial framing, kept for comparison."""
+    size = len(data)
+    return bytes([0xDE, 0xAD]) + bytes([size & 0xFF, (size >> 8) & 0xFF]) + data
+
+
+def _benchmark_encode(frame_count=20_000, repeat=7):
+    import timeit
+
+    command = b"km.move(10,-10)"
+    batch = [command] * 32
+    cases = [
+        ("legacy concat (before)", lambda: _legacy_encode(command), 1),
+        ("encode_frame", lambda: encode_frame(command), 1),
+        ("legacy concat + join x32 (before)",
+         lambda: b"".join([_legacy_encode(c) for c in batch]), len(batch)),
+        ("encode_frames x32", lambda: encode_frames(batch), len(batch)),
+    ]
+    print(f"{len(command)}-byte payload, best of {repeat}")
+    for label, func, frames_per_call in cases:
+        calls = max(frame_count // frames_per_call, 1)
+        best = min(timeit.repeat(func, number=calls, repeat=repeat))
+        print(f"{label:<34} {best * 1e9 / (calls * frames_per_call):>8.0f} ns/frame")
+
+
+if __name__ == "__main__":
+    import sys
+
+    which = sys.argv[1] if len(sys.argv) > 1 else "all"
+    if which in ("decode", "all"):
+        _benchmark_decode()
+    if which in ("encode", "all"):
+        _benchmark_encode()
+    if which in ("bulk", "all"):
+        _benchmark_bulk(sys.argv[2] if len(sys.argv) > 2 else None)
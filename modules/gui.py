@@ -22,6 +22,10 @@ from .utils import get_icon_path, get_main_folder
 from .usb_name_changer import USBNameChanger, USBNameChangerFTDI
 from tkinter import messagebox
 from .device_manager import DeviceManager
+from .rtt_profiler import RttProfiler
+
+RTT_PROBES = 200  # Probes per "RTT Test" click
+CONSOLE_TIMEOUT = 2.0  # Seconds to wait for a reply to a console command
 
 
 class GUI:
@@ -51,6 +55,7 @@ class GUI:
         self.port_mapping = {}
         self.is_devkit_mode = False
         self.is_online = False
+        self.rtt_running = False
         self.is_offline = True
 
         # Configure grid weights for the main window
@@ -340,6 +345,7 @@ class GUI:
 
         # Handlers
         self.serial_handler = SerialHandler(self.logger, self.update_mcu_status, self.root)
+        self.device_manager.attach_inventory(self.serial_handler.port_inventory)  # Shared, hotplug-driven
         self.flasher = Flasher(self.logger, self.serial_handler, self.config_manager)
         self.main_folder = get_main_folder()
 
@@ -488,7 +494,7 @@ class GUI:
         # Left button frame
         self.left_button_frame = ctk.CTkFrame(self.root, fg_color="transparent")
         self.left_button_frame.grid(row=2, column=0, padx=5, pady=5, sticky="nw")
-        for i in range(5):  # Adjusted for USB toggle button
+        for i in range(6):  # Adjusted for USB toggle and RTT test buttons
             self.left_button_frame.grid_rowconfigure(i, weight=0, minsize=40)
         self.left_button_frame.grid_columnconfigure(0, weight=1)
 
@@ -542,6 +548,20 @@ class GUI:
         )
         self.usb_name_toggle_button.grid(row=3, column=0, padx=0, pady=5, sticky="w")
 
+        # Row 4 is taken by the left flash button
+        self.rtt_button = ctk.CTkButton(
+            self.left_button_frame,
+            text="RTT Test",
+            command=self.run_rtt_profile,
+            fg_color=button_bg,
+            text_color=button_fg,
+            border_color=button_fg,
+            border_width=1,
+            font=("Helvetica", 12)
+        )
+        self.rtt_button.grid(row=5, column=0, padx=0, pady=5, sticky="w")
+        self.rtt_button.grid_remove()
+
         # Right button frame
         self.right_button_frame = ctk.CTkFrame(self.root, fg_color="transparent")
         self.right_button_frame.grid(row=2, column=2, padx=5, pady=5, sticky="ne")
@@ -760,6 +780,7 @@ class GUI:
             getattr(self, 'left_flash_button', None),
             getattr(self, 'right_flash_button', None),
             getattr(self, 'usb_name_toggle_button', None),  # Added USB toggle button
+            getattr(self, 'rtt_button', None),
         ]
 
         for btn in buttons:
@@ -796,6 +817,7 @@ class GUI:
                     self.clear_log_button.grid()
                     self.makcu_button.grid()
                     self.usb_name_toggle_button.grid()  # Show in Normal mode
+                    self.rtt_button.grid()
 
                     device_name, com_port = changer.get_device_info()
                     if device_name:
@@ -809,6 +831,7 @@ class GUI:
                     self.clear_log_button.grid()
                     self.makcu_button.grid()
                     self.usb_name_toggle_button.grid_remove()
+                    self.rtt_button.grid_remove()
 
                     mcu_status = f"MAKCU Connected in {mode_text} mode on {self.serial_handler.com_port}"
 
@@ -822,6 +845,7 @@ class GUI:
                 self.clear_log_button.grid_remove()
                 self.makcu_button.grid_remove()
                 self.usb_name_toggle_button.grid_remove()
+                self.rtt_button.grid_remove()
                 self.hide_flash_buttons()
 
             self.label_mcu.configure(text=mcu_status, text_color=status_color)
@@ -978,24 +1002,22 @@ class GUI:
 
     def send_input(self, event=None):
         """
-        Send the entered command via the serial connection.
+        Send the entered command through the serial handler's framed TX queue.
+        Never blocks the Tk thread: the reply is printed with its latency when
+        it arrives (or a note if none arrives in time).
         """
         command = self.text_input.get().strip()
         if command:
             if not self.serial_handler.is_connected or not self.serial_handler.serial_open:
                 self.logger.terminal_print("Connect to Device first")
             else:
-                command += "\r"
                 self.text_input.delete(0, ctk.END)
-                try:
-                    self.serial_handler.serial_connection.write(command.encode())
-                    self.logger.terminal_print(f"Sent command: {command.strip()}")
-                    if len(self.command_history) >= 20:
-                        self.command_history.pop(0)
-                    self.command_history.append(command.strip())
-                    self.history_position = -1
-                except Exception as e:
-                    self.logger.terminal_print(f"Failed to send command: {e}")
+                if len(self.command_history) >= 20:
+                    self.command_history.pop(0)
+                self.command_history.append(command)
+                self.history_position = -1
+                self.logger.terminal_print(f"Sent command: {command}")
+                self.serial_handler.send_console_command(command, timeout=CONSOLE_TIMEOUT)
         return "break"
 
     def clear_terminal(self):
@@ -1083,17 +1105,44 @@ class GUI:
         """
         if self.serial_handler.is_connected:
             if self.serial_handler.serial_connection and self.serial_handler.serial_connection.is_open:
-                try:
-                    serial_command = "km.move(50,50)\r"
-                    self.serial_handler.serial_connection.write(serial_command.encode())
+                # Queued for the writer thread; errors are reported by the handler
+                if self.serial_handler.write_to_serial("km.move(50,50)\r"):
                     self.logger.terminal_print("Mouse move command sent, did mouse move?")
-                except Exception as e:
-                    self.logger.terminal_print(f"Error sending command: {e}")
             else:
                 self.logger.terminal_print("Serial connection is not open.")
         else:
             self.logger.terminal_print("Serial connection is not established. Please connect first.")
 
+    def run_rtt_profile(self):
+        """
+        Measure command round-trip time to the connected device and print the
+        min/p50/p99/max, throughput and loss. Runs off the Tk thread.
+        """
+        if not self.serial_handler.is_connected or self.serial_handler.current_mode != "Normal":
+            self.logger.terminal_print("RTT test needs a device connected in Normal mode.")
+            return
+        if self.rtt_running:
+            self.logger.terminal_print("RTT test already running.")
+            return
+        self.rtt_running = True
+        self.rtt_button.configure(state="disabled")
+
+        def task():
+            try:
+                self.logger.terminal_print(f"Sending {RTT_PROBES} x km.version() to {self.serial_handler.com_port}...")
+                profiler = RttProfiler(self.serial_handler.send_command, self.serial_handler.com_port)
+                report = profiler.run(RTT_PROBES)
+                self.logger.terminal_print(report.format())
+                if report.p50 is not None:
+                    self.serial_handler.update_device_state(last_rtt=report.p50)
+            except Exception as e:
+                self.logger.terminal_print(f"RTT test failed: {e}")
+            finally:
+                self.rtt_running = False
+                self.root.after(0, lambda: self.rtt_button.configure(state="normal"))
+
+        threading.Thread(target=task, daemon=True).start()
+
     def test_flash_mode(self):
         """
         Test function in Flash mode.
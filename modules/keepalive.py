@@ -0,0 +1,86 @@
+# modules/keepalive.py
+
+import time
+
+
+class KeepAliveScheduler:
+    """
+    Decides when a device link needs a liveness probe.
+
+    Any received byte counts as proof of life, so a busy link is never probed.
+    Only after idle_interval seconds without RX (and without a probe already in
+    flight) is a probe due. If nothing at all is received for dead_after
+    seconds the link is declared dead. Probe round-trip times are smoothed
+    with an EWMA (RFC 6298 style, with a mean deviation term).
+
+    The scheduler keeps no thread of its own: the owner asks next_wakeup()
+    how long it may sleep and calls due()/is_dead() when it wakes.
+    """
+
+    def __init__(self, idle_interval=2.0, dead_after=6.0, probe_timeout=1.0,
+                 alpha=0.125, beta=0.25, clock=time.monotonic):
+        self.idle_interval = idle_interval
+        self.dead_after = dead_after
+        self.probe_timeout = probe_timeout
+        self.alpha = alpha
+        self.beta = beta
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        """Starts over, e.g. after a (re)connect. The link counts as alive now."""
+        now = self.clock()
+        self.last_rx = now
+        self.last_probe = now
+        self.probe_outstanding = False
+        self.probes_sent = 0
+        self.probes_failed = 0
+        self.last_rtt = None
+        self.rtt_ewma = None
+        self.rtt_dev = None
+
+    def note_rx(self, now=None):
+        """Call for every received chunk."""
+        self.last_rx = self.clock() if now is None else now
+
+    def due(self, now=None):
+        """True when the link has been idle long enough to need a probe."""
+        now = self.clock() if now is None else now
+        if self.probe_outstanding:
+            return False
+        return now - max(self.last_rx, self.last_probe) >= self.idle_interval
+
+    def is_dead(self, now=None):
+        """True when nothing was received within dead_after seconds."""
+        now = self.clock() if now is None else now
+        return now - self.last_rx >= self.dead_after
+
+    def probe_sent(self, now=None):
+        self.last_probe = self.clock() if now is None else now
+        self.probe_outstanding = True
+        self.probes_sent += 1
+
+    def probe_done(self, rtt=None):
+        """Records a probe result; rtt is None when the probe failed or timed out."""
+        self.probe_outstanding = False
+        if rtt is None:
+            self.probes_failed += 1
+            return
+        self.last_rtt = rtt
+        if self.rtt_ewma is None:
+            self.rtt_ewma = rtt
+            self.rtt_dev = rtt / 2
+        else:
+            self.rtt_dev += self.beta * (abs(rtt - self.rtt_ewma) - self.rtt_dev)
+            self.rtt_ewma += self.alpha * (rtt - self.rtt_ewma)
+
+    def next_wakeup(self, now=None, minimum=0.05):
+        """Seconds until a probe may be due or the link may be declared dead."""
+        now = self.clock() if now is None else now
+        until_dead = self.last_rx + self.dead_after - now
+        if self.probe_outstanding:
+            # The probe resolves (or times out) by last_probe + probe_timeout
+            wait = min(self.last_probe + self.probe_timeout - now, until_dead)
+        else:
+            wait = min(max(self.last_rx, self.last_probe) + self.idle_interval - now, until_dead)
+        return max(wait, minimum)
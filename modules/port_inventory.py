@@ -0,0 +1,160 @@
+# modules/port_inventory.py
+
+import threading
+import time
+
+import serial.tools.list_ports
+
+
+def normalize_usb_id(value):
+    """
+    VID or PID as an int. Accepts ints (pyserial's port.vid) and hex strings
+    as written in devices.json / KNOWN_DEVICES ("1A86", "0x1a86").
+    Returns None for missing or malformed values.
+    """
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return int(str(value).strip(), 16)
+    except ValueError:
+        return None
+
+
+class PortSnapshot:
+    """
+    Immutable view of the attached ports at one moment, indexed for O(1)
+    lookups by device name, (vid, pid), serial number and location.
+    Several ports can share a (vid, pid), so that index maps to a tuple.
+    """
+
+    __slots__ = ("ports", "taken_at", "by_device", "by_vid_pid", "by_serial", "by_location")
+
+    def __init__(self, ports, taken_at):
+        self.ports = tuple(ports)
+        self.taken_at = taken_at
+        self.by_device = {}
+        self.by_serial = {}
+        self.by_location = {}
+        by_vid_pid = {}
+        for port in self.ports:
+            self.by_device[port.device] = port
+            if port.vid is not None:
+                by_vid_pid.setdefault((port.vid, port.pid), []).append(port)
+            if port.serial_number:
+                self.by_serial[port.serial_number] = port
+            if port.location:
+                self.by_location[port.location] = port
+        self.by_vid_pid = {key: tuple(ports) for key, ports in by_vid_pid.items()}
+
+
+class PortInventory:
+    """
+    The one place that enumerates serial ports.
+
+    Every lookup is served from an indexed PortSnapshot. With a running
+    DeviceWatcher the snapshot is rebuilt from the watcher's state on each
+    attach/detach (no enumeration at all) and is never stale. Without one,
+    a lookup enumerates again once the snapshot is older than ttl seconds.
+
+    Listeners added here receive the watcher's PortEvents after the
+    snapshot has been updated, so they can query the inventory directly.
+    """
+
+    def __init__(self, watcher=None, ttl=2.0, clock=time.monotonic):
+        self.watcher = watcher
+        self.ttl = ttl
+        self.clock = clock
+        self.listeners = ()
+        self.lock = threading.Lock()
+        self.refreshes = 0  # Snapshots built so far
+        self._snapshot = None
+        if watcher is not None:
+            watcher.add_listener(self._on_port_event)
+
+    @property
+    def live(self):
+        """True while a running watcher keeps the snapshot current."""
+        return self.watcher is not None and self.watcher.running
+
+    def add_listener(self, callback):
+        """callback(PortEvent) is called after every hotplug-driven update."""
+        with self.lock:
+            self.listeners += (callback,)
+
+    def remove_listener(self, callback):
+        with self.lock:
+            self.listeners = tuple(l for l in self.listeners if l != callback)
+
+    def _on_port_event(self, event):
+        self._build(self.watcher.ports.values())
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception:
+                pass  # Same rule as the watcher: a failing listener affects only itself
+
+    def _build(self, ports):
+        snapshot = PortSnapshot(ports, self.clock())
+        self._snapshot = snapshot
+        self.refreshes += 1
+        return snapshot
+
+    def refresh(self):
+        """Rebuilds the snapshot now: from the watcher if it runs, else by enumerating."""
+        if self.live:
+            return self._build(self.watcher.ports.values())
+        return self._build(serial.tools.list_ports.comports())
+
+    def snapshot(self):
+        """The current snapshot, refreshed first if it is stale."""
+        snapshot = self._snapshot
+        if snapshot is None or (not self.live and self.clock() - snapshot.taken_at > self.ttl):
+            with self.lock:  # One caller enumerates; the others reuse its result
+                snapshot = self._snapshot
+                if snapshot is None or (not self.live and self.clock() - snapshot.taken_at > self.ttl):
+                    snapshot = self.refresh()
+        return snapshot
+
+    def age(self):
+        """Seconds since the snapshot was taken (None before the first one)."""
+        snapshot = self._snapshot
+        return None if snapshot is None else self.clock() - snapshot.taken_at
+
+    @property
+    def stale(self):
+        """True when the next lookup will have to enumerate again."""
+        snapshot = self._snapshot
+        return snapshot is None or (not self.live and self.clock() - snapshot.taken_at > self.ttl)
+
+    def status(self):
+        """Source, age and size of the snapshot, for status displays."""
+        snapshot = self._snapshot
+        return {
+            "source": "hotplug" if self.live else "ttl",
+            "age": self.age(),
+            "stale": self.stale,
+            "ports": len(snapshot.ports) if snapshot else 0,
+            "refreshes": self.refreshes,
+        }
+
+    # ── Lookups ──────────────────────────────────────────────────────────────
+
+    def ports(self):
+        return self.snapshot().ports
+
+    def get(self, device):
+        return self.snapshot().by_device.get(device)
+
+    def find(self, vid, pid):
+        """All ports with this VID/PID (ints or hex strings), as a tuple."""
+        return self.snapshot().by_vid_pid.get((normalize_usb_id(vid), normalize_usb_id(pid)), ())
+
+    def first(self, vid, pid):
+        ports = self.find(vid, pid)
+        return ports[0] if ports else None
+
+    def by_serial(self, serial_number):
+        return self.snapshot().by_serial.get(serial_number)
+
+    def by_location(self, location):
+        return self.snapshot().by_location.get(location)
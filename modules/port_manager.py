@@ -0,0 +1,353 @@
+# modules/port_manager.py
+
+import io
+import selectors
+import socket
+import threading
+import time
+import serial
+
+from modules.device_watch import DeviceWatcher, ATTACHED
+from modules.port_inventory import PortInventory, normalize_usb_id
+from modules.frame_codec import FrameReassembler, encode_command, encode_frame
+from modules.command_pipeline import CommandPipeline, expected_response_kind
+from modules.serial_handler import SerialHandler
+from modules.keepalive import KeepAliveScheduler
+from modules.serial_metrics import SerialMetrics
+
+
+class PortState:
+    """Everything the manager keeps for one open port."""
+
+    def __init__(self, com_port, mode, baudrate, serial_connection, on_frame=None,
+                 command_timeout=1.0, keepalive=None):
+        self.com_port = com_port
+        self.mode = mode
+        self.baudrate = baudrate
+        self.serial_connection = serial_connection
+        self.reassembler = FrameReassembler()
+        # Deadlines are checked by the manager thread, not a thread per port
+        self.pipeline = CommandPipeline(default_timeout=command_timeout, use_reaper=False)
+        self.on_frame = on_frame
+        self.fd = None          # None when the port cannot be selected (Windows)
+        self.metrics = SerialMetrics(com_port)
+        self.opened_at = time.monotonic()
+        self.write_lock = threading.Lock()
+        self.keepalive = keepalive  # KeepAliveScheduler, None in Flash mode
+
+
+class MultiPortManager:
+    """
+    Holds many MAKCU ports open at once and services all of them from a single
+    thread.
+
+    Ports with a selectable fd (POSIX) are multiplexed with a selector, so an
+    idle bench costs nothing; ports without one (Windows) are swept with a
+    non-blocking in_waiting check on the same thread. Discovery of newly
+    plugged devices also runs on that thread, so the thread count stays at
+    one no matter how many units are attached. It reads a PortInventory kept
+    current by a DeviceWatcher (udev or a cheap name-only poll), so ports
+    are only enumerated when something was plugged or unplugged, and an
+    attach wakes the thread at once.
+
+    Callbacks (on_frame, on_attach, on_detach) run on the manager thread and
+    must be quick. on_frame(port_state, kind, payload) gets a memoryview that
+    is only valid during the call; port_state.reassembler.frame_ns is the
+    time.monotonic_ns() at which the frame's first byte was read.
+    """
+
+    POLL_INTERVAL = 0.005  # Sweep interval for ports that cannot be selected
+    SCAN_INTERVAL = 1.0    # Retry interval for known ports that failed to open; attaches wake it early
+
+    def __init__(self, logger, on_frame=None, on_attach=None, on_detach=None,
+                 known_devices=None, command_timeout=1.0,
+                 keepalive_idle=SerialHandler.KEEPALIVE_IDLE,
+                 keepalive_deadline=SerialHandler.KEEPALIVE_DEADLINE,
+                 port_inventory=None):
+        self.logger = logger
+        self.on_frame = on_frame
+        self.on_attach = on_attach
+        self.on_detach = on_detach
+        self.known_devices = known_devices or SerialHandler.KNOWN_DEVICES
+        self.command_timeout = command_timeout
+        self.keepalive_idle = keepalive_idle
+        self.keepalive_deadline = keepalive_deadline
+        self.ports = {}  # com_port -> PortState
+        self.lock = threading.Lock()
+        self.running = False
+        self.auto_discover = False
+        self.thread = None
+        self._selector = selectors.DefaultSelector()
+        # Self-pipe so open/close/stop can wake the selector immediately
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._next_scan = 0.0
+        # Share an inventory (e.g. SerialHandler.port_inventory) or watch ports ourselves
+        self.owns_watcher = port_inventory is None
+        self.port_inventory = port_inventory or PortInventory(DeviceWatcher(poll_interval=self.SCAN_INTERVAL))
+        self.port_inventory.add_listener(self._on_port_event)
+
+    # ── lifecycle ────────────────────────────────────────────────────────────
+
+    def start(self, auto_discover=True):
+        """Starts the manager thread. With auto_discover, known devices are opened as they appear."""
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.auto_discover = auto_discover
+            if auto_discover and self.owns_watcher:
+                self.port_inventory.watcher.start()  # First, so discovery never enumerates itself
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stops the manager thread and closes every port."""
+        with self.lock:
+            self.running = False
+        if self.owns_watcher:
+            self.port_inventory.watcher.stop()
+        self._wake()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5)
+        for com_port in list(self.ports):
+            self.close_port(com_port)
+
+    # ── ports ────────────────────────────────────────────────────────────────
+
+    def open_port(self, com_port, mode="Normal", baudrate=115200, on_frame=None):
+        """Opens com_port and adds it to the manager. Returns its PortState or None."""
+        if com_port in self.ports:
+            return self.ports[com_port]
+        try:
+            connection = serial.Serial(
+                port=com_port,
+                baudrate=baudrate,
+                timeout=0,
+                parity=serial.PARITY_NONE,
+                stopbits=serial.STOPBITS_ONE,
+                bytesize=serial.EIGHTBITS
+            )
+        except Exception as e:
+            self.logger.terminal_print(f"Failed to connect to {com_port}: {e}")
+            return None
+
+        keepalive = None
+        if mode == "Normal":  # The ROM bootloader does not answer km.version()
+            keepalive = KeepAliveScheduler(
+                idle_interval=self.keepalive_idle,
+                dead_after=self.keepalive_deadline,
+                probe_timeout=self.command_timeout
+            )
+        state = PortState(com_port, mode, baudrate, connection, on_frame or self.on_frame,
+                          command_timeout=self.command_timeout, keepalive=keepalive)
+        try:
+            state.fd = connection.fileno()
+        except (AttributeError, io.UnsupportedOperation, OSError):
+            state.fd = None
+        with self.lock:
+            self.ports[com_port] = state
+            if state.fd is not None:
+                self._selector.register(state.fd, selectors.EVENT_READ, state)
+        self._wake()
+        if self.on_attach:
+            self.on_attach(state)
+        return state
+
+    def close_port(self, com_port, reason="Connection closed"):
+        """Removes com_port from the manager and closes it."""
+        with self.lock:
+            state = self.ports.pop(com_port, None)
+            if state is None:
+                return
+            if state.fd is not None:
+                try:
+                    self._selector.unregister(state.fd)
+                except (KeyError, ValueError):
+                    pass
+        state.pipeline.cancel_all(ConnectionError(reason))
+        try:
+            state.serial_connection.close()
+        except Exception as e:
+            self.logger.terminal_print(f"Error closing {com_port}: {e}")
+        if self.on_detach:
+            self.on_detach(state)
+
+    def discover(self):
+        """
+        Opens every attached port that matches a known device, not just the
+        first one. Served from the port inventory; nothing is enumerated
+        while the device watcher runs.
+        """
+        opened = []
+        for device in self.known_devices:
+            for port in self.port_inventory.find(device["vid"], device["pid"]):
+                if port.device in self.ports:
+                    continue
+                state = self.open_port(port.device, device["mode"])
+                if state:
+                    opened.append(state)
+        return opened
+
+    def _on_port_event(self, event):
+        """Inventory listener (watcher thread): a known device appearing triggers discovery now."""
+        if event.action != ATTACHED or not self.auto_discover:
+            return
+        ids = (event.info.vid, event.info.pid)
+        if any(ids == (normalize_usb_id(d["vid"]), normalize_usb_id(d["pid"])) for d in self.known_devices):
+            self._next_scan = 0.0
+            self._wake()
+
+    # ── commands ─────────────────────────────────────────────────────────────
+
+    def write_to_serial(self, com_port, data, size=None):
+        """Writes one DEAD frame to com_port."""
+        state = self.ports.get(com_port)
+        if state is None:
+            self.logger.terminal_print(f"Attempted to write but {com_port} is not open.")
+            return
+        self._write(state, data, size)
+
+    def send_command(self, com_port, command, payload=b"", timeout=None, tag=None, silent=False):
+        """Sends a command to one port and returns a Future with its response."""
+        state = self.ports.get(com_port)
+        if state is None:
+            raise ConnectionError(f"{com_port} is not open")
+        future = state.pipeline.register(command, expected_response_kind(command), tag, timeout, silent)
+        try:
+            self._write(state, encode_command(command, payload))
+        except Exception as e:
+            state.pipeline.fail(future, e)
+        return future
+
+    def broadcast(self, command, payload=b"", timeout=None):
+        """Sends a command to every open port. Returns {com_port: Future}."""
+        return {
+            com_port: self.send_command(com_port, command, payload, timeout)
+            for com_port in list(self.ports)
+        }
+
+    def _write(self, state, data, size=None):
+        """Encodes the frame, then writes it while holding the port's write lock."""
+        frame = encode_frame(data, size)
+        with state.write_lock:
+            state.serial_connection.write(frame)
+            state.metrics.note_tx(len(frame))
+            state.metrics.tx_frames += 1
+
+    def snapshot(self):
+        """Returns {com_port: metrics snapshot} for every open port."""
+        with self.lock:
+            states = list(self.ports.values())
+        return {
+            state.com_port: state.metrics.snapshot(state.reassembler, state.pipeline)
+            for state in states
+        }
+
+    # ── manager thread ───────────────────────────────────────────────────────
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def _run(self):
+        while self.running:
+            now = time.monotonic()
+            if self.auto_discover and now >= self._next_scan:
+                self._next_scan = now + self.SCAN_INTERVAL
+                try:
+                    self.discover()
+                except Exception as e:
+                    self.logger.terminal_print(f"Port scan failed: {e}")
+
+            with self.lock:
+                states = list(self.ports.values())
+            polled = [state for state in states if state.fd is None]
+
+            # Sleep until data, the next scan, or the next poll sweep
+            timeout = max(self._next_scan - time.monotonic(), 0) if self.auto_discover else None
+            if polled:
+                timeout = self.POLL_INTERVAL if timeout is None else min(timeout, self.POLL_INTERVAL)
+            if any(state.pipeline.pending_count for state in states):
+                timeout = 0.05 if timeout is None else min(timeout, 0.05)
+            for state in states:
+                if state.keepalive:
+                    wakeup = state.keepalive.next_wakeup()
+                    timeout = wakeup if timeout is None else min(timeout, wakeup)
+
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        self._wake_r.recv(4096)
+                    except OSError:
+                        pass
+                    continue
+                self._service(key.data)
+            for state in polled:
+                self._service(state)
+            for state in states:
+                state.pipeline.expire()
+                if state.keepalive and state.com_port in self.ports:
+                    self._check_keepalive(state)
+
+    def _check_keepalive(self, state):
+        """Probes an idle port and drops it once nothing was received within the deadline."""
+        now = time.monotonic()
+        keepalive = state.keepalive
+        if keepalive.is_dead(now):
+            self.logger.terminal_print(
+                f"No data from {state.com_port} for {keepalive.dead_after:.0f}s, closing."
+            )
+            self.close_port(state.com_port, reason="Keep-alive deadline exceeded")
+            return
+        if keepalive.due(now):
+            keepalive.probe_sent(now)
+            try:
+                future = self.send_command(
+                    state.com_port, 'km.version()', timeout=keepalive.probe_timeout, silent=True
+                )
+            except Exception:
+                keepalive.probe_done(None)
+                return
+            future.add_done_callback(
+                lambda f: keepalive.probe_done(
+                    time.monotonic() - keepalive.last_probe
+                    if not f.cancelled() and f.exception() is None else None
+                )
+            )
+
+    def _service(self, state):
+        """Reads whatever is available on one port and dispatches its frames."""
+        try:
+            data = state.serial_connection.read(max(state.serial_connection.in_waiting, 1))
+            read_ns = time.monotonic_ns()
+        except Exception as e:
+            self.logger.terminal_print(f"Device on {state.com_port} disconnected: {e}")
+            self.close_port(state.com_port, reason="Device disconnected")
+            return
+        if not data:
+            return
+        metrics = state.metrics
+        metrics.note_rx(len(data))
+
+        if state.keepalive:
+            state.keepalive.note_rx()
+
+        def dispatch(kind, payload):
+            metrics.note_frame(kind)
+            metrics.dispatch_latency.record((time.monotonic_ns() - read_ns) / 1e9)
+            command = state.pipeline.resolve(kind, payload)
+            if command:
+                metrics.command_rtt.record(time.monotonic() - command.sent_at)
+                return
+            if state.on_frame:
+                state.on_frame(state, kind, payload)
+
+        try:
+            state.reassembler.feed(data, dispatch, read_ns)
+        except Exception as e:
+            self.logger.terminal_print(f"Error parsing UART frames on {state.com_port}: {e}")
+            state.reassembler.reset()
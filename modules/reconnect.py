@@ -0,0 +1,218 @@
+# modules/reconnect.py
+
+import random
+import threading
+import time
+from collections import deque
+
+PROBING = "probing"          # Ready for a connection attempt
+CONNECTED = "connected"
+BACKOFF = "backoff"          # Last attempt failed; waiting out the backoff delay
+QUARANTINED = "quarantined"  # Failed too often; retried only after a long pause
+
+
+class PortConnectState:
+    """Connection state of one candidate port."""
+
+    __slots__ = ("com_port", "mode", "baudrate", "state", "failures", "next_attempt",
+                 "attempting", "attempt_started", "first_seen", "down_since", "connected_at", "last_error")
+
+    def __init__(self, com_port, mode, baudrate, now, down_since=None):
+        self.com_port = com_port
+        self.mode = mode
+        self.baudrate = baudrate
+        self.state = PROBING
+        self.failures = 0          # Consecutive failed attempts
+        self.next_attempt = now
+        self.attempting = False    # An attempt is running on another thread
+        self.attempt_started = None
+        self.first_seen = now      # When the port (re)appeared
+        self.down_since = down_since  # When the previous connection was lost, if any
+        self.connected_at = None
+        self.last_error = None
+
+
+class ReconnectTracker:
+    """
+    Non-blocking per-port reconnect state machine:
+
+        PROBING --ok--> CONNECTED --lost--> PROBING
+           |                                   ^
+           +--fail--> BACKOFF --delay over-----+
+                         |
+                         +--too many fails--> QUARANTINED --pause over--> PROBING
+
+    The tracker never sleeps or opens ports itself. The owner reports which
+    ports are present (seen/forget_missing), asks for the most preferred port
+    that may be tried now (best_ready), runs that attempt wherever it likes,
+    reports the outcome (succeeded/failed) and sleeps for next_wakeup()
+    seconds. Every port keeps its own backoff, so a failing port only delays
+    itself.
+
+    Backoff doubles from base_delay up to max_delay with random jitter, so
+    several ports (or several hosts) that failed together do not retry in
+    lockstep. Connect times are kept in connect_times as
+    (com_port, seconds since the port appeared, seconds since the last
+    disconnect or None).
+    """
+
+    def __init__(self, base_delay=0.25, max_delay=8.0, jitter=0.5,
+                 quarantine_after=6, quarantine_time=60.0, attempt_timeout=2.0,
+                 clock=time.monotonic, rng=random.random, history=100):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.quarantine_after = quarantine_after
+        self.quarantine_time = quarantine_time
+        self.attempt_timeout = attempt_timeout  # After this, a hanging attempt no longer holds up other ports
+        self.clock = clock
+        self.rng = rng
+        self.ports = {}  # com_port -> PortConnectState
+        self.connect_times = deque(maxlen=history)
+        self.last_disconnect = None
+        self.lock = threading.Lock()  # Outcomes are reported from attempt threads
+
+    def seen(self, com_port, mode, baudrate=115200):
+        """
+        Notes that com_port is present, as a device in this mode. Returns its
+        state entry. An idle entry takes the new mode and baud rate, since a
+        port name (e.g. a ttyACM node) can be reused by another device before
+        forget_missing() has run.
+        """
+        with self.lock:
+            entry = self.ports.get(com_port)
+            if entry is None:
+                entry = PortConnectState(com_port, mode, baudrate, self.clock(), self.last_disconnect)
+                self.ports[com_port] = entry
+            elif entry.state != CONNECTED and not entry.attempting:
+                entry.mode = mode
+                entry.baudrate = baudrate
+            return entry
+
+    def forget_missing(self, present):
+        """Drops ports that are no longer attached, so a re-plugged device starts fresh."""
+        with self.lock:
+            for com_port in list(self.ports):
+                entry = self.ports[com_port]
+                if com_port not in present and entry.state != CONNECTED and not entry.attempting:
+                    del self.ports[com_port]
+
+    def best_ready(self, order, now=None):
+        """
+        Returns the first port of order (com_ports, most preferred first) that
+        may be attempted now, marked as attempting, or None. Nothing is
+        returned while another attempt is still running, so normally one port
+        is opened at a time and a less preferred one never wins a race; an
+        attempt running longer than attempt_timeout (e.g. an open() hanging
+        in the driver) stops holding up the other ports.
+        """
+        now = self.clock() if now is None else now
+        with self.lock:
+            if any(entry.attempting and now - entry.attempt_started < self.attempt_timeout
+                   for entry in self.ports.values()):
+                return None
+            for com_port in order:
+                entry = self.ports.get(com_port)
+                if entry is None or entry.attempting or entry.state == CONNECTED or entry.next_attempt > now:
+                    continue
+                entry.state = PROBING
+                entry.attempting = True
+                entry.attempt_started = now
+                return entry
+        return None
+
+    def succeeded(self, com_port, now=None):
+        """Records a successful attempt. Returns the seconds since the port appeared."""
+        now = self.clock() if now is None else now
+        with self.lock:
+            entry = self.ports.get(com_port)
+            if entry is None:
+                return None
+            entry.state = CONNECTED
+            entry.attempting = False
+            entry.failures = 0
+            entry.connected_at = now
+            elapsed = now - entry.first_seen
+            downtime = now - entry.down_since if entry.down_since is not None else None
+            self.connect_times.append((com_port, elapsed, downtime))
+            return elapsed
+
+    def failed(self, com_port, error=None, now=None):
+        """Records a failed attempt and schedules the next one. Returns the new state."""
+        now = self.clock() if now is None else now
+        with self.lock:
+            entry = self.ports.get(com_port)
+            if entry is None:
+                return None
+            entry.attempting = False
+            entry.failures += 1
+            entry.last_error = error
+            if entry.failures >= self.quarantine_after:
+                entry.state = QUARANTINED
+                entry.next_attempt = now + self.quarantine_time
+                entry.failures = 0  # Start over with short delays after the pause
+            else:
+                entry.state = BACKOFF
+                delay = min(self.max_delay, self.base_delay * (2 ** (entry.failures - 1)))
+                entry.next_attempt = now + delay * (1 - self.jitter * self.rng())
+            return entry.state
+
+    def retry_now(self, com_port):
+        """
+        Claims com_port for an immediate attempt (explicit user request),
+        skipping its backoff. Returns the entry marked as attempting, or None
+        if it is connected or an attempt on it is already running.
+        """
+        with self.lock:
+            entry = self.ports.get(com_port)
+            if entry is None or entry.state == CONNECTED or entry.attempting:
+                return None
+            entry.state = PROBING
+            entry.attempting = True
+            entry.attempt_started = entry.next_attempt = self.clock()
+            return entry
+
+    def released(self, com_port):
+        """An attempt finished without taking the port (e.g. another port won)."""
+        with self.lock:
+            entry = self.ports.get(com_port)
+            if entry is not None:
+                entry.attempting = False
+
+    def disconnected(self, com_port, now=None):
+        """The connection on com_port was lost or closed; it may be attempted again at once."""
+        now = self.clock() if now is None else now
+        with self.lock:
+            self.last_disconnect = now
+            entry = self.ports.get(com_port)
+            if entry is not None:
+                entry.state = PROBING
+                entry.attempting = False
+                entry.next_attempt = now
+                entry.first_seen = now
+                entry.down_since = now
+                entry.connected_at = None
+
+    def next_wakeup(self, now=None, default=1.0, minimum=0.01):
+        """Seconds until the earliest scheduled attempt, capped at default."""
+        now = self.clock() if now is None else now
+        with self.lock:
+            # While an attempt runs, other ports wait for it to finish or to outlive attempt_timeout
+            blocked_until = max(
+                (entry.attempt_started + self.attempt_timeout for entry in self.ports.values()
+                 if entry.attempting and now - entry.attempt_started < self.attempt_timeout),
+                default=now
+            )
+            pending = [max(entry.next_attempt, blocked_until) for entry in self.ports.values()
+                       if not entry.attempting and entry.state != CONNECTED]
+        if not pending:
+            return default
+        return max(minimum, min(default, min(pending) - now))
+
+    def snapshot(self):
+        """{com_port: (state, consecutive failures, last error)} for status displays."""
+        with self.lock:
+            return {
+                com_port: (entry.state, entry.failures, entry.last_error)
+                for com_port, entry in self.ports.items()
+            }
@@ -0,0 +1,124 @@
+# modules/ring_buffer.py
+
+import threading
+from array import array
+
+
+class FrameRingBuffer:
+    """
+    Fixed-size binary ring buffer for high-rate frame streams (device logs).
+
+    Storage is preallocated up front: `slots` records of at most `slot_size`
+    bytes each. write() copies the payload into the next slot and never
+    blocks or allocates; once the ring is full the oldest record is
+    overwritten. Longer payloads are truncated and counted.
+
+    There is one writer (the serial reader) and any number of readers, each
+    with its own cursor (see reader()). A reader that falls `slots` or more
+    records behind loses the overwritten records and counts them in its
+    `dropped` counter, so a slow consumer never slows down the writer.
+    """
+
+    def __init__(self, slots=4096, slot_size=256):
+        self.slots = slots
+        self.slot_size = slot_size
+        self._data = bytearray(slots * slot_size)
+        self._lengths = array('I', [0]) * slots
+        self.head = 0          # Sequence number of the next record to be written
+        self.truncated = 0     # Records cut down to slot_size
+        self.bytes_written = 0
+
+    def write(self, payload):
+        """Appends one record. Safe to call with a memoryview."""
+        length = len(payload)
+        if length > self.slot_size:
+            payload = payload[:self.slot_size]
+            length = self.slot_size
+            self.truncated += 1
+        index = self.head % self.slots
+        start = index * self.slot_size
+        self._data[start:start + length] = payload
+        self._lengths[index] = length
+        self.head += 1  # Publish only after the record is complete
+        self.bytes_written += length
+
+    def reader(self, from_start=False):
+        """Returns a new independent reader, positioned at the newest record by default."""
+        return RingReader(self, 0 if from_start else self.head)
+
+    @property
+    def records_written(self):
+        return self.head
+
+
+class RingReader:
+    """A consumer's cursor into a FrameRingBuffer."""
+
+    def __init__(self, ring, cursor):
+        self.ring = ring
+        self.cursor = cursor
+        self.dropped = 0  # Records overwritten before this reader got to them
+
+    @property
+    def available(self):
+        return min(self.ring.head - self.cursor, self.ring.slots - 1)
+
+    def read(self, max_records=None):
+        """Returns up to max_records records (bytes) in order, oldest first."""
+        ring = self.ring
+        head = ring.head
+        # The slot of record `head` may be mid-write, and it is also the slot
+        # of record head - slots, so only the newest slots - 1 are readable.
+        behind = head - self.cursor
+        if behind > ring.slots - 1:
+            self.dropped += behind - (ring.slots - 1)
+            self.cursor = head + 1 - ring.slots
+        end = head if max_records is None else min(head, self.cursor + max_records)
+
+        records = []
+        for seq in range(self.cursor, end):
+            index = seq % ring.slots
+            start = index * ring.slot_size
+            records.append(bytes(ring._data[start:start + ring._lengths[index]]))
+
+        # The writer may have lapped us while we were copying; discard those
+        overrun = ring.head + 1 - ring.slots - self.cursor
+        if overrun > 0:
+            lost = min(overrun, len(records))
+            del records[:lost]
+            self.dropped += lost
+            self.cursor += lost
+        self.cursor += len(records)
+        return records
+
+
+class RingFileSink:
+    """
+    Drains a ring reader into a binary file on its own thread, at its own
+    pace. Each record is written as a 16-bit little-endian length + payload.
+    """
+
+    def __init__(self, reader, path, interval=0.2):
+        self.reader = reader
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join(timeout=2)
+
+    def _run(self):
+        with open(self.path, 'ab') as f:
+            while True:
+                stopping = self.stop_event.wait(self.interval)
+                for record in self.reader.read():
+                    f.write(len(record).to_bytes(2, 'little'))
+                    f.write(record)
+                f.flush()
+                if stopping:
+                    return
@@ -0,0 +1,261 @@
+# modules/rtt_profiler.py
+
+import math
+import threading
+import time
+
+
+class RttReport:
+    """Result of one profiling run. Times are in seconds."""
+
+    def __init__(self, label, command, sent, rtts, duration, errors, resyncs=0):
+        self.label = label
+        self.command = command
+        self.sent = sent
+        self.received = len(rtts)
+        self.lost = sent - len(rtts)
+        self.errors = errors  # {exception type name: count} for the lost probes
+        self.resyncs = resyncs  # Pauses after a timeout to let a late reply drain
+        self.duration = duration
+        rtts = sorted(rtts)
+        self.min = rtts[0] if rtts else None
+        self.p50 = _percentile(rtts, 50)
+        self.p99 = _percentile(rtts, 99)
+        self.max = rtts[-1] if rtts else None
+        self.mean = sum(rtts) / len(rtts) if rtts else None
+
+    @property
+    def loss(self):
+        """Lost fraction, 0.0 .. 1.0."""
+        return self.lost / self.sent if self.sent else 0.0
+
+    @property
+    def throughput(self):
+        """Answered probes per second over the whole run."""
+        return self.received / self.duration if self.duration else 0.0
+
+    def as_dict(self):
+        return {
+            "label": self.label,
+            "command": self.command,
+            "sent": self.sent,
+            "received": self.received,
+            "lost": self.lost,
+            "loss": self.loss,
+            "errors": dict(self.errors),
+            "resyncs": self.resyncs,
+            "duration": self.duration,
+            "throughput": self.throughput,
+            "min": self.min,
+            "p50": self.p50,
+            "p99": self.p99,
+            "max": self.max,
+            "mean": self.mean,
+        }
+
+    def format(self):
+        if not self.received:
+            return f"{self.label}: 0/{self.sent} replies to {self.command!r} ({_format_errors(self.errors)})"
+        line = (
+            f"{self.label}: {self.received}/{self.sent} replies, {self.loss:.1%} loss, "
+            f"RTT min {self.min * 1e3:.2f} / p50 {self.p50 * 1e3:.2f} / "
+            f"p99 {self.p99 * 1e3:.2f} / max {self.max * 1e3:.2f} ms, "
+            f"{self.throughput:,.0f} replies/s"
+        )
+        if self.errors:
+            line += f" ({_format_errors(self.errors)})"
+        if self.resyncs:
+            line += f", {self.resyncs} resyncs"
+        return line
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)  # Nearest rank
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def _format_errors(errors):
+    return ", ".join(f"{count} {name}" for name, count in sorted(errors.items())) or "no errors"
+
+
+class RttProfiler:
+    """
+    Measures command round-trip time over a live link.
+
+    send_command(command, timeout=..., silent=True) must return a Future, as
+    SerialHandler.send_command and a MultiPortManager port (see
+    profile_ports) do, so probes use the normal framing and response
+    matching. Probes are silent: their replies are not printed.
+
+    With rate=None probes go back to back, `window` at a time (window=1 is a
+    strict ping-pong; a larger window measures pipelined throughput). With a
+    rate, probes are sent on a fixed schedule regardless of replies, which is
+    how loss under a given load shows up.
+
+    Probe replies are identical, so they can only be matched in order. When
+    a probe times out, its reply may still arrive and would be taken as the
+    next probe's. So after a timeout the profiler resyncs: it lets the
+    probes in flight finish, discards their samples ("Discarded"), and
+    sends nothing for resync_quiet seconds (default: timeout), so that a
+    late reply arrives with no probe outstanding. In rate mode the probes
+    scheduled during that pause are skipped and not counted as sent.
+    """
+
+    def __init__(self, send_command, label="device"):
+        self.send_command = send_command
+        self.label = label
+
+    def run(self, count=100, rate=None, command='km.version()', timeout=1.0, window=1, resync_quiet=None):
+        """Sends count probes and returns an RttReport. Blocks until the last one resolves."""
+        quiet = timeout if resync_quiet is None else resync_quiet
+        rtts = []
+        errors = {}
+        lock = threading.Lock()
+        slots = threading.Semaphore(window)
+        state = {"epoch": 0, "in_flight": 0, "resyncs": 0}  # epoch: timeouts seen so far
+        idle = threading.Condition(lock)
+
+        def probe_done(future, sent_at, epoch):
+            rtt = time.perf_counter() - sent_at
+            with lock:
+                if future.cancelled():
+                    errors["Cancelled"] = errors.get("Cancelled", 0) + 1
+                elif future.exception() is not None:
+                    name = type(future.exception()).__name__
+                    errors[name] = errors.get(name, 0) + 1
+                    if isinstance(future.exception(), TimeoutError):
+                        state["epoch"] += 1
+                elif epoch != state["epoch"]:
+                    # Sent before an earlier probe timed out: the reply may be that probe's
+                    errors["Discarded"] = errors.get("Discarded", 0) + 1
+                else:
+                    rtts.append(rtt)
+                state["in_flight"] -= 1
+                idle.notify_all()
+            if rate is None:
+                slots.release()
+
+        def resync(epoch):
+            """Waits for the probes in flight, then for a quiet period. Returns the current epoch."""
+            with lock:
+                while state["in_flight"]:
+                    idle.wait()
+            time.sleep(quiet)
+            with lock:
+                state["resyncs"] += 1
+                return state["epoch"]
+
+        futures = []
+        sent = 0
+        epoch = 0
+        start = resumed_at = time.perf_counter()
+        for i in range(count):
+            if rate is None:
+                slots.acquire()
+            else:
+                if start + i / rate < resumed_at:
+                    continue  # Scheduled during a resync pause
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            with lock:
+                timed_out = state["epoch"] != epoch
+            if timed_out:
+                epoch = resync(epoch)
+                resumed_at = time.perf_counter()
+                if rate is not None:
+                    continue  # This probe's slot passed during the pause
+            sent_at = time.perf_counter()
+            with lock:
+                state["in_flight"] += 1
+            try:
+                future = self.send_command(command, timeout=timeout, silent=True)
+            except Exception as e:
+                with lock:
+                    state["in_flight"] -= 1
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                sent += 1
+                if rate is None:
+                    slots.release()
+                continue
+            sent += 1
+            future.add_done_callback(lambda f, sent_at=sent_at, epoch=epoch: probe_done(f, sent_at, epoch))
+            futures.append(future)
+
+        for future in futures:
+            try:
+                future.exception(timeout=timeout + 1.0)  # Waits without raising the probe's error
+            except Exception:
+                pass
+        duration = time.perf_counter() - start
+        with lock:
+            return RttReport(self.label, command, sent, list(rtts), duration, dict(errors), state["resyncs"])
+
+
+def profile_ports(manager, count=100, rate=None, command='km.version()', timeout=1.0, window=1):
+    """
+    Profiles every Normal-mode port open in a MultiPortManager at the same
+    time (the ROM bootloader does not answer km. commands).
+    Returns {com_port: RttReport}.
+    """
+    reports = {}
+    threads = []
+
+    def run(com_port):
+        def send(cmd, timeout=None, silent=False):
+            return manager.send_command(com_port, cmd, timeout=timeout, silent=silent)
+        reports[com_port] = RttProfiler(send, com_port).run(count, rate, command, timeout, window)
+
+    for com_port, state in list(manager.ports.items()):
+        if state.mode != "Normal":
+            continue
+        thread = threading.Thread(target=run, args=(com_port,), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return reports
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# python -m modules.rtt_profiler [PORT ...] [-n COUNT] [--rate HZ] [--window N]
+#                                [--baud RATE] [--command CMD]
+# Without ports, every attached known device is profiled.
+# ─────────────────────────────────────────────────────────────────────────────
+
+if __name__ == "__main__":
+    import argparse
+
+    from modules.port_manager import MultiPortManager
+
+    parser = argparse.ArgumentParser(description="Measure command round-trip time to MAKCU devices.")
+    parser.add_argument("ports", nargs="*", help="serial ports (default: all known devices)")
+    parser.add_argument("-n", "--count", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=None, help="probes per second (default: back to back)")
+    parser.add_argument("--window", type=int, default=1, help="outstanding probes when back to back")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--command", default="km.version()")
+    args = parser.parse_args()
+
+    class _ConsoleLogger:
+        def terminal_print(self, message):
+            print(message)
+
+    manager = MultiPortManager(_ConsoleLogger(), keepalive_idle=3600, keepalive_deadline=3600)
+    if args.ports:
+        for port in args.ports:
+            manager.open_port(port, baudrate=args.baud)
+    else:
+        manager.discover()
+    manager.start(auto_discover=False)
+    try:
+        if not manager.ports:
+            print("No devices found.")
+        results = profile_ports(manager, args.count, args.rate, args.command, args.timeout, args.window)
+        for report in results.values():
+            print(report.format())
+    finally:
+        manager.stop()
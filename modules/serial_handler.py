@@ -1,8 +1,48 @@
+import os
 import serial
-import serial.tools.list_ports
+import struct
 import threading
 import time
-import struct
+from modules.frame_codec import FrameReassembler, FRAME_KM, FRAME_DEAD, encode_command, encode_frame, encode_frames, parse_uart_frames
+from modules.command_pipeline import CommandPipeline, expected_response_kind
+from modules.serial_writer import SerialWriter
+from modules.keepalive import KeepAliveScheduler
+from modules.ring_buffer import FrameRingBuffer
+from modules.capture import CaptureWriter, CAPTURE_RX, CAPTURE_TX
+from modules.reconnect import ReconnectTracker, QUARANTINED
+from modules.frame_bus import FrameBus
+from modules.serial_metrics import SerialMetrics
+from modules.device_watch import DeviceWatcher, DETACHED
+from modules.port_inventory import PortInventory, normalize_usb_id
+from modules.device_registry import DeviceRegistry, device_identity
+from modules.utils import get_main_folder
+
+
+class PortLease:
+    """
+    Temporary ownership of SerialHandler's port by another component (e.g.
+    the flasher). While the lease is held the handler's reader, writer and
+    keep-alive are suspended; use it as a context manager to hand the port
+    back. connection is the open serial handle, or None when the lease asked
+    for the handle to be released for an external process.
+    """
+
+    def __init__(self, handler, owner, com_port, mode, baudrate, connection):
+        self.handler = handler
+        self.owner = owner
+        self.com_port = com_port
+        self.mode = mode
+        self.baudrate = baudrate
+        self.connection = connection
+        self.was_connected = bool(com_port) and handler.is_connected
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.handler.release_port(self)
+        return False
+
 
 class SerialHandler:
     def connect_device_profile(self, device_profile):
@@ -16,7 +56,9 @@ class SerialHandler:
         com_port = self.find_com_port(vid, pid)
         if com_port:
             self.logger.terminal_print(f"Connecting to {device_profile['name']} on {com_port} (baudrate: {baudrate})")
-            self.auto_connect(com_port, device_profile.get('mode', 'Normal'), baudrate=baudrate)
+            # A profile that names its baud rate keeps it; only MAKCU devices are negotiated anyway
+            self.auto_connect(com_port, device_profile.get('mode', 'Normal'), baudrate=baudrate,
+                              negotiate_baud='baudrate' not in proto)
         else:
             self.logger.terminal_print(f"Device {device_profile['name']} not found on USB.")
     KNOWN_DEVICES = [
@@ -32,6 +74,37 @@ class SerialHandler:
     SET_DEV_LOG     = 0xA7
     LOG_HOST_TOGGLE = 0x96
 
+    READ_TIMEOUT = 0.5  # Max time the reader blocks before re-checking its stop flags
+    COMMAND_TIMEOUT = 1.0  # Default time to wait for a command's response
+    TX_QUEUE_SIZE = 256    # Frames the writer thread may hold before callers are refused
+    KEEPALIVE_IDLE = 2.0      # Probe only after this long without any RX
+    KEEPALIVE_DEADLINE = 6.0  # Declare the link dead after this long without any RX
+    SCAN_INTERVAL = 1.0       # Reconnect check interval while disconnected; hotplug events wake it early
+    RECONNECT_BASE_DELAY = 0.25      # First backoff after a failed open; doubles per failure
+    RECONNECT_MAX_DELAY = 8.0
+    RECONNECT_QUARANTINE_AFTER = 6   # Failures before a port is parked
+    RECONNECT_QUARANTINE_TIME = 60.0
+    RECONNECT_ATTEMPT_TIMEOUT = 2.0  # A slower open() no longer holds up the other ports
+
+    BAUD_LADDER = (4_000_000, 2_000_000, 1_000_000, 921600, 115200)
+    SUPPORTED_BAUD_RATES = BAUD_LADDER
+    BAUD_PROBE_ATTEMPTS = 3   # Consecutive km.version() replies needed to call a rate stable
+    BAUD_PROBE_TIMEOUT = 0.2
+    BAUD_SETTLE_ATTEMPTS = 2  # Probes allowed to fail right after a switch
+    AUTO_NEGOTIATE_BAUD = True  # Climb the ladder after connecting a Normal-mode MAKCU with no known best rate
+    REGISTRY_PATH = os.path.join(get_main_folder(), 'device_registry.jsonl')
+
+    DEVICE_LOG_SLOTS = 8192        # Records kept in the device log ring
+    DEVICE_LOG_SLOT_SIZE = 256     # Max bytes per record; longer frames are truncated
+    DEVICE_LOG_PRINT_BATCH = 50    # Records shown in the terminal per GUI tick
+    DEVICE_LOG_PRINT_INTERVAL = 100  # ms between terminal drains
+
+    LOG_QUEUE_SIZE = 2048       # Frames a terminal subscriber may fall behind before dropping
+    BINARY_PRINT_RATE = 200     # DEAD frames/s shown in the terminal; console text is not limited
+    BINARY_PRINT_BURST = 400
+
+    CAPTURE_FOLDER = os.path.join(get_main_folder(), 'captures')
+
     def __init__(self, logger, update_mcu_status_callback, root):
         self.logger = logger
         self.update_mcu_status = update_mcu_status_callback
@@ -46,19 +119,48 @@ class SerialHandler:
         self.monitoring_active = False
         self.monitoring_thread = None
         self.serial_thread = None  # To handle serial communication
-        self.buffer = bytearray()
+        self.writer = None         # SerialWriter: TX thread for the open connection
+        self.reassembler = FrameReassembler()  # Keeps partial frames across reads
+        self.pipeline = CommandPipeline(default_timeout=self.COMMAND_TIMEOUT)  # Outstanding commands
+        self.keepalive = KeepAliveScheduler(
+            idle_interval=self.KEEPALIVE_IDLE,
+            dead_after=self.KEEPALIVE_DEADLINE,
+            probe_timeout=self.COMMAND_TIMEOUT
+        )
+        self.monitor_wakeup = threading.Event()  # Cuts the monitor thread's sleep short
+        self.reconnect = ReconnectTracker(
+            base_delay=self.RECONNECT_BASE_DELAY,
+            max_delay=self.RECONNECT_MAX_DELAY,
+            quarantine_after=self.RECONNECT_QUARANTINE_AFTER,
+            quarantine_time=self.RECONNECT_QUARANTINE_TIME,
+            attempt_timeout=self.RECONNECT_ATTEMPT_TIMEOUT
+        )
+        self.connect_lock = threading.Lock()  # Serializes adopting a freshly opened port
+        self.lease = None  # PortLease while another component owns the port
+        self.device_watch = DeviceWatcher(poll_interval=self.SCAN_INTERVAL)  # Attach/detach events
+        self.port_inventory = PortInventory(self.device_watch)  # Indexed port snapshot for all lookups
+        self.port_inventory.add_listener(self.handle_port_event)
+        self.registry = DeviceRegistry(self.REGISTRY_PATH)
+        self.device = None  # Registry record of the connected device
+        self.negotiation_lock = threading.Lock()  # Held while a baud rate negotiation runs
+        self.device_log = None         # FrameRingBuffer while device log streaming is on
+        self.device_log_reader = None  # Terminal's cursor into device_log
+        self.capture = None            # CaptureWriter while a session capture is running
+        self.frame_bus = FrameBus()    # Decoded frames for the logger and other subscribers
+        self.metrics = SerialMetrics()  # I/O counters and latency histograms, see get_metrics()
+        self.console_subscription = None  # km. text -> terminal
+        self.binary_subscription = None   # DEAD frames -> terminal, rate limited
+        self.console_command = None  # [command, sent_ns, timer] of the console line awaiting its reply
+        self.console_lock = threading.Lock()
         self.lock = threading.Lock()  # To prevent race conditions
         self.is_flashing = False      # Flag to indicate flashing status
         self.flashing_lock = threading.Lock()  # Lock for flashing to prevent race conditions
+        self.toggle_serial_printing(self.print_serial_data)
 
     def find_com_port(self, vid, pid):
         """Finds the COM port matching the given VID and PID."""
-        for port in serial.tools.list_ports.comports():
-            hwid = port.hwid.upper()
-            vid_pid = f"VID:PID={vid.upper()}:{pid.upper()}"
-            if vid_pid in hwid:
-                return port.device
-        return None
+        port = self.port_inventory.first(vid, pid)
+        return port.device if port else None
 
     def start_monitoring(self):
         """Starts monitoring for a serial connection."""
@@ -68,6 +170,7 @@ class SerialHandler:
                 return
 
             self.monitoring_active = True
+            self.device_watch.start()
             self.monitoring_thread = threading.Thread(target=self.monitor_ports, daemon=True)
             self.monitoring_thread.start()
 
@@ -79,6 +182,8 @@ class SerialHandler:
                 return
 
             self.monitoring_active = False
+            self.monitor_wakeup.set()
+        self.device_watch.stop()
 
         if self.serial_connection and self.serial_connection.is_open:
             self.close_connection()
@@ -88,160 +193,372 @@ class SerialHandler:
             if self.monitoring_thread.is_alive():
                 self.logger.terminal_print("Failed to fully stop monitoring thread.")
 
+    def find_known_ports(self):
+        """
+        Returns {com_port: mode} for every attached known device, from one
+        scan, in KNOWN_DEVICES order (most preferred first).
+        """
+        found = {}
+        for device in self.KNOWN_DEVICES:
+            for port in self.port_inventory.find(device["vid"], device["pid"]):
+                found.setdefault(port.device, device["mode"])
+        return found
+
+    def known_mode(self, port):
+        """The KNOWN_DEVICES mode of a ListPortInfo's VID/PID, or None for any other device."""
+        ids = (port.vid, port.pid)
+        for device in self.KNOWN_DEVICES:
+            if ids == (normalize_usb_id(device["vid"]), normalize_usb_id(device["pid"])):
+                return device["mode"]
+        return None
+
+    def handle_port_event(self, event):
+        """
+        Device watcher listener (runs on the watcher thread). A known device
+        appearing, or the current port disappearing, wakes the monitor so it
+        reacts within milliseconds instead of at its next scheduled check.
+        """
+        known = self.known_mode(event.info) is not None
+        if event.action == DETACHED and event.device == self.com_port and self.is_connected:
+            self.logger.terminal_print(f"{event.device} was unplugged.")
+            known = True
+        if known:
+            self.monitor_wakeup.set()
+
     def monitor_ports(self):
-        """Continuously scans for known devices and connects to them."""
+        """
+        Watches for known devices and connects to them. Attach/detach events
+        come from the device watcher (udev, or a cheap polling diff), so no
+        port enumeration happens while nothing changes.
+        Connection attempts run on their own thread, one port at a time in
+        KNOWN_DEVICES order, and failed ports back off individually (see
+        modules.reconnect), so one bad port never delays the others. While connected, the thread sleeps until
+        the keep-alive scheduler needs it: any RX counts as liveness, so a probe
+        is only sent after an idle interval.
+        """
         while self.monitoring_active:
+            wait = self.SCAN_INTERVAL
             if not self.is_connected:
                 # Wait here if flashing is in progress
                 with self.flashing_lock:
-                    for device in self.KNOWN_DEVICES:
-                        vid, pid, mode = device["vid"], device["pid"], device["mode"]
-                        com_port = self.find_com_port(vid, pid)
-                        if com_port:
-                            self.auto_connect(com_port, mode)
-                            break  # Exit loop once connected
-            elif self.is_connected:
-                # Send km.version() command for keep-alive check with callback
-                self.send_command('km.version()', callback=self.handle_version_response)
-
-            time.sleep(1)  # Avoid busy-waiting
-
-
-    def handle_version_response(self, response):
-         """
-         Handle the response to the km.version() command.
-         """
-         if response == "km.MAKCU\n\r>>>":
-             # Update MCU status only if the response is correct
-             self.update_mcu_status()
-         else:
-             self.logger.terminal_print("Invalid response received during keep-alive check.")
-    
-            
-    def read_response(self):
+                    wait = self.reconnect_step()
+            elif self.current_mode == "Normal" and self.lease is None:
+                # The ROM bootloader in Flash mode does not answer km.version()
+                wait = self.check_keepalive()
+
+            self.monitor_wakeup.wait(wait)
+            self.monitor_wakeup.clear()
+
+    def check_keepalive(self):
         """
-        Reads the response from the MCU and invokes the callback if set.
+        Sends a keep-alive probe if the link has been idle and drops the connection
+        if nothing was received within the deadline. Returns seconds until the next check.
         """
-        if self.response_callback:
-            response = self.buffer.decode('utf-8', errors='ignore')
-            # Call the callback with the response
-            self.response_callback(response)
-            # Clear the callback after use
-            self.response_callback = None
+        now = time.monotonic()
+        if self.keepalive.is_dead(now):
+            self.logger.terminal_print(
+                f"No data from device for {self.keepalive.dead_after:.0f}s, reconnecting."
+            )
+            self.handle_disconnect()
+            return 0
+        if self.keepalive.due(now):
+            self.keepalive.probe_sent(now)
+            # No status callback: the GUI is only refreshed when the connection state changes.
+            # The tag keeps other km. lines (e.g. console replies) from answering the probe.
+            future = self.send_command(
+                'km.version()', timeout=self.keepalive.probe_timeout, tag=b"km.MAKCU", silent=True
+            )
+            future.add_done_callback(self._keepalive_done)
+        return self.keepalive.next_wakeup()
+
+    def _keepalive_done(self, future):
+        ok = not future.cancelled() and future.exception() is None
+        rtt = time.monotonic() - self.keepalive.last_probe if ok else None
+        self.keepalive.probe_done(rtt)
+        device = self.device
+        if rtt is not None and device is not None:
+            self.registry.note(device["key"], last_rtt=rtt)  # Journaled on disconnect
+
+    def read_response(self, kind, payload):
+        """
+        Matches a received frame against the outstanding commands and completes
+        the matching command's future. Returns the matched command or None.
+        """
+        return self.pipeline.resolve(kind, payload)
 
 
 
-    def auto_connect(self, com_port, mode, baudrate=115200, retry_attempts=5, retry_delay=2):
-        attempt = 0
-        while attempt < retry_attempts and not self.is_connected:
-            try:
-                self.serial_connection = serial.Serial(
-                    port=com_port,
-                    baudrate=baudrate,
-                    timeout=0.5,
-                    parity=serial.PARITY_NONE,
-                    stopbits=serial.STOPBITS_ONE,
-                    bytesize=serial.EIGHTBITS
+    def reconnect_step(self):
+        """
+        One non-blocking pass of the reconnect state machine: scans once, starts
+        an attempt on the most preferred known port whose backoff is over (in
+        KNOWN_DEVICES order) and returns how long the monitor may sleep.
+        """
+        ports = self.find_known_ports()
+        for com_port, mode in ports.items():
+            self.reconnect.seen(com_port, mode)
+        self.reconnect.forget_missing(ports)
+        entry = self.reconnect.best_ready(ports)
+        if entry is not None:
+            threading.Thread(target=self._connect_attempt, args=(entry,), daemon=True).start()
+        return self.reconnect.next_wakeup(default=self.SCAN_INTERVAL)
+
+    def auto_connect(self, com_port, mode, baudrate=115200, negotiate_baud=True):
+        """
+        Starts connecting to com_port without waiting for the result. The port
+        is adopted even while monitoring is off (e.g. from the device wizard);
+        if the attempt fails, a running monitor retries it with backoff.
+        With negotiate_baud=False the link stays at baudrate.
+        """
+        self.reconnect.seen(com_port, mode, baudrate)
+        entry = self.reconnect.retry_now(com_port)
+        if entry is not None:
+            threading.Thread(target=self._connect_attempt, args=(entry, True, negotiate_baud), daemon=True).start()
+
+    def _connect_attempt(self, entry, explicit=False, negotiate_baud=True):
+        """
+        Runs on its own thread: opens one candidate port and adopts it if still
+        needed. Attempts the monitor started are dropped once monitoring stops;
+        explicit ones (auto_connect) are not.
+        """
+        com_port = entry.com_port
+        try:
+            connection = serial.Serial(
+                port=com_port,
+                baudrate=entry.baudrate,
+                timeout=self.READ_TIMEOUT,
+                parity=serial.PARITY_NONE,
+                stopbits=serial.STOPBITS_ONE,
+                bytesize=serial.EIGHTBITS
+            )
+        except Exception as e:
+            state = self.reconnect.failed(com_port, e)
+            if state == QUARANTINED:
+                self.logger.terminal_print(
+                    f"Unable to connect to {com_port}, retrying in {self.RECONNECT_QUARANTINE_TIME:.0f}s: {e}"
                 )
-                self.is_connected = True
-                self.serial_open = True
-                self.com_speed = baudrate
-                self.current_mode = mode
-                self.com_port = com_port
-                self.serial_thread = threading.Thread(target=self.serial_communication_thread, daemon=True)
-                self.serial_thread.start()
-                self.root.after(0, self.update_mcu_status)  # Thread-safe GUI update
-            except Exception as e:
+            elif entry.failures == 1:
                 self.logger.terminal_print(f"Failed to connect to {com_port}: {e}")
-                attempt += 1
-                time.sleep(retry_delay)
-        if not self.is_connected:
-            self.logger.terminal_print(f"Unable to connect to {com_port} after {retry_attempts} attempts.")
+            self.monitor_wakeup.set()  # Reschedule around the new backoff
+            return
+
+        with self.connect_lock:
+            if self.is_connected or self.lease is not None or not (explicit or self.monitoring_active):
+                connection.close()  # Already connected or leased, or monitoring stopped meanwhile
+                self.reconnect.released(com_port)
+                return
+            self._adopt_connection(connection, com_port, entry.mode, entry.baudrate, negotiate_baud)
+        elapsed = self.reconnect.succeeded(com_port)
+        if elapsed is not None:
+            self.logger.terminal_print(f"Connected to {com_port} ({entry.mode}) in {elapsed:.2f}s")
+
+    def _adopt_connection(self, connection, com_port, mode, baudrate, negotiate_baud=True):
+        self.serial_connection = connection
+        self.is_connected = True
+        self.serial_open = True
+        self.com_speed = baudrate
+        self.current_mode = mode
+        self.com_port = com_port
+        if self.metrics.com_port != com_port:
+            self.metrics = SerialMetrics(com_port)  # Counters are per port
+        self.metrics.connects += 1
+        self._start_io()
+        self._restore_device(com_port, mode, baudrate, negotiate_baud)
+        self.root.after(0, self.update_mcu_status)  # Thread-safe GUI update
+
+    def _restore_device(self, com_port, mode, baudrate, negotiate_baud=True):
+        """
+        Looks the device up in the registry by its USB identity, not the port
+        name, so a device that a hub re-enumerated under another port keeps
+        its context. For a MAKCU in Normal mode (a KNOWN_DEVICES VID/PID) the
+        link is then brought to the remembered baud rate, or negotiated once if
+        none is known yet. Other devices are never sent SET_BAUD_RATE.
+        """
+        port = self.port_inventory.get(com_port)
+        self.device = self.registry.attach(port) if port is not None else None
+        preferred = self.device.get("baud_rate") if self.device else None
+        if self.device is not None and self.device["connects"] >= 2:
+            details = ", ".join(
+                f"{label} {self.device[name]}" for name, label in (("firmware", "firmware"), ("baud_rate", "baud"))
+                if self.device.get(name)
+            )
+            self.logger.terminal_print(f"Known device {self.device['key']}" + (f" ({details})" if details else ""))
+        if (negotiate_baud and self.AUTO_NEGOTIATE_BAUD and mode == "Normal" and preferred != baudrate
+                and port is not None and self.known_mode(port) == "Normal"):
+            self.start_baud_negotiation()
+
+    def start_baud_negotiation(self):
+        """Runs negotiate_baud_rate() on a background thread, unless one is already running."""
+        if not self.negotiation_lock.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                self.negotiate_baud_rate()
+            finally:
+                self.negotiation_lock.release()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def update_device_state(self, com_port=None, **fields):
+        """
+        Stores state (e.g. firmware=, last_rtt=) for the device on com_port
+        (default: the connected one) in the registry.
+        """
+        port = self.port_inventory.get(com_port or self.com_port)
+        if port is not None:
+            record = self.registry.update(device_identity(port), **fields)
+            if self.device is not None and record["key"] == self.device["key"]:
+                self.device = record
+
+    def _start_io(self):
+        """Starts the writer and reader threads on self.serial_connection."""
+        self.reassembler.reset()
+        self.keepalive.reset()
+        self.writer = SerialWriter(
+            self.serial_connection,
+            max_queue=self.TX_QUEUE_SIZE,
+            on_error=self.handle_write_error,
+            on_write=self._on_tx
+        )
+        self.writer.start()
+        self.serial_thread = threading.Thread(target=self.serial_communication_thread, daemon=True)
+        self.serial_thread.start()
+        self.monitor_wakeup.set()  # Switch the monitor over to keep-alive duty
 
     def serial_communication_thread(self):
-        """Handles serial communication while connected."""
-        while self.monitoring_active and self.is_connected and self.serial_open:
+        """
+        Handles serial communication while connected.
+        Blocks in read() until the first byte arrives (or READ_TIMEOUT expires),
+        then drains whatever else is already waiting, so RX latency is bounded
+        by the driver rather than a poll interval and an idle line costs no CPU.
+        Each chunk is stamped with time.monotonic_ns() as soon as read() returns;
+        the stamp travels through reassembly to every frame decoded from it.
+        """
+        while self.is_connected and self.serial_open and self.lease is None:
             try:
-                if self.serial_connection and self.serial_connection.is_open:
-                    bytes_to_read = self.serial_connection.in_waiting
-                    if bytes_to_read > 0:
-                        data = self.serial_connection.read(bytes_to_read)
-                        if data:
-                            self.handle_incoming_data(data)
+                connection = self.serial_connection
+                if not connection or not connection.is_open:
+                    break
+                data = connection.read(1)  # Blocks until data or timeout
+                if not data:
+                    continue  # Timeout: re-check the loop condition
+                read_ns = time.monotonic_ns()  # Arrival of the chunk's first byte
+                bytes_to_read = connection.in_waiting
+                if bytes_to_read > 0:
+                    data += connection.read(bytes_to_read)
+                capture = self.capture
+                if capture:
+                    capture.record(CAPTURE_RX, data, read_ns)
+                self.handle_incoming_data(data, read_ns)
             except Exception as e:
                 # self.logger.terminal_print(f"Serial communication error: {e}")
-                self.handle_disconnect()
+                if self.is_connected and self.lease is None:  # Not already dropped or leased
+                    self.handle_disconnect()
                 break
-            time.sleep(0.1)
 
     def parse_uart_frames(self, data):
         """
         Parses incoming UART data to handle frames starting with 'km.' or 0xDE, 0xAD.
+        Returns the number of bytes consumed; the rest is an incomplete frame.
         """
-        index = 0
-        while index < len(data):
-            # Handle 'km.' frames
-            if data[index:index + 3] == b'km.':
-                end_index = data.find(b'\r', index)
-                if end_index != -1:  # Full frame found
-                    frame = data[index:end_index + 1]  # Include '\r'
-                    self.logger.terminal_print(frame.decode('utf-8', errors='ignore'))
-                    index = end_index + 1  # Move past the end of the frame
-                else:
-                    break  # Incomplete frame, wait for more data
-                
-            # Handle 0xDE, 0xAD frames
-            elif data[index:index + 2] == b'\xDE\xAD':
-                if index + 4 <= len(data):
-                    size = struct.unpack('<H', data[index + 2:index + 4])[0]  # Frame size
-                    end_index = index + 4 + size
-                    if end_index <= len(data):  # Full frame available
-                        frame = data[index + 4:end_index]  # Extract the actual payload
-                        try:
-                            decoded_frame = frame.decode('utf-8', errors='ignore')
-                            self.logger.terminal_print(decoded_frame)
-                        except Exception as e:
-                            self.logger.terminal_print(f"Error decoding frame: {e}")
-                        index = end_index  # Move past the end of the frame
-                    else:
-                        break  # Incomplete frame, wait for more data
-                else:
-                    break  # Incomplete frame header, wait for more data
-                
-            else:
-                # Skip to the next potential header
-                next_km = data.find(b'km.', index + 1)
-                next_dead = data.find(b'\xDE\xAD', index + 1)
-    
-                if next_km == -1 and next_dead == -1:
-                    break  # No more potential headers
-                
-                # Jump to the closest header
-                if next_km == -1:
-                    index = next_dead
-                elif next_dead == -1:
-                    index = next_km
-                else:
-                    index = min(next_km, next_dead)
+        return parse_uart_frames(data, self.handle_frame)
 
-    def handle_incoming_data(self, data):
+    def handle_frame(self, kind, payload):
         """
-        Handles incoming UART data by appending it to a buffer and parsing frames.
+        Handles one complete frame. payload is a memoryview that is only valid
+        during this call; self.reassembler.frame_ns is the frame's read time.
         """
+        now = time.monotonic()
+        self.metrics.note_frame(kind)
+        self.metrics.dispatch_latency.record((time.monotonic_ns() - self.reassembler.read_ns) / 1e9)
+        command = self.read_response(kind, payload)
+        if command:
+            self.metrics.command_rtt.record(now - command.sent_at)
+        if command and command.silent:
+            return  # e.g. keep-alive replies: consumed, not shown
+        if kind == FRAME_DEAD and self.device_log is not None and not command:
+            self.device_log.write(payload)  # Never blocks; consumers drain at their own pace
+            return
+        # Subscribers (the terminal among them) decode and print on their own threads
+        self.frame_bus.publish(kind, payload, self.reassembler.frame_ns)
+
+    def _log_frame(self, frame):
+        """Terminal subscriber for both channels: runs on its own thread, off the RX path."""
+        subscription = self.console_subscription if frame.kind == FRAME_KM else self.binary_subscription
+        lost = subscription.take_lost() if subscription else 0
+        if lost:
+            self.logger.terminal_print(f"[{lost} {frame.kind} frames not shown]")
+        console = self._take_console_command() if frame.kind == FRAME_KM else None
+        if console and frame.timestamp_ns is not None:
+            latency = (frame.timestamp_ns - console[1]) / 1e6
+            self.logger.terminal_print(f"{frame.text.rstrip()}  ({latency:.1f} ms)")
+        else:
+            self.logger.terminal_print(frame.text)
+
+    def send_console_command(self, command, timeout=2.0):
+        """
+        Sends a line typed in the console, terminated with '\\r' as the device
+        expects of console input. It is not registered in the command
+        pipeline: arbitrary text may get no km. reply at all and would then take
+        the reply meant for the next command. Instead the next km. line shown
+        in the terminal is printed as its reply, with the latency on the same
+        line. Returns False if the line could not be queued.
+        """
+        self._take_console_command()  # A newer line supersedes one still waiting
+        if self.console_subscription is None:
+            return self._queue_frame(encode_frame(command + "\r"))  # Terminal output is off; nothing to time
+        timer = threading.Timer(timeout, self._console_timeout, args=(timeout,))
+        timer.daemon = True
+        with self.console_lock:
+            self.console_command = [command, time.monotonic_ns(), timer]  # Before the write, so a fast reply is not missed
+        if not self._queue_frame(encode_frame(command + "\r")):
+            self._take_console_command()
+            return False
+        timer.start()
+        return True
+
+    def _take_console_command(self):
+        with self.console_lock:
+            console, self.console_command = self.console_command, None
+        if console:
+            console[2].cancel()
+        return console
+
+    def _console_timeout(self, timeout):
+        with self.console_lock:
+            console = self.console_command
+            if console is None or console[2] is not threading.current_thread():
+                return  # Answered, or replaced by a newer line
+            self.console_command = None
+        self.logger.terminal_print(f"{console[0]}: no reply within {timeout:.1f}s")
+
+    def handle_incoming_data(self, data, timestamp_ns=None):
+        """
+        Handles incoming UART data. Complete frames are dispatched right away and
+        only the unconsumed tail is kept for the next read. timestamp_ns is the
+        time.monotonic_ns() at which the chunk was read (default: now).
+        """
+        self.keepalive.note_rx()
+        self.metrics.note_rx(len(data))
         with self.lock:
-            self.buffer.extend(data)  # Add new data to the buffer
             try:
-                self.parse_uart_frames(self.buffer)
+                self.reassembler.feed(data, self.handle_frame, timestamp_ns)
             except Exception as e:
                 self.logger.terminal_print(f"Error parsing UART frames: {e}")
-            finally:
-                # Trim processed data
-                self.buffer = self.buffer[len(self.buffer):]
+                self.reassembler.reset()
 
     def handle_disconnect(self):
         self.logger.terminal_print("Device disconnected.")
         self.is_connected = False
         self.serial_open = False
+        self.pipeline.cancel_all(ConnectionError("Device disconnected"))
+        self._stop_writer(flush=False)
+        self.reconnect.disconnected(self.com_port)
+        self.metrics.disconnects += 1
+        self.registry.flush()
+        self.monitor_wakeup.set()  # Rescan now rather than at the next keep-alive wakeup
 
         if self.serial_connection:
             try:
@@ -258,19 +575,118 @@ class SerialHandler:
         try:
             if self.serial_connection and self.serial_connection.is_open:
                 self.write_to_serial("DEBUG_OFF\n")
+                self._stop_writer(flush=True)
                 time.sleep(0.5)
                 self.serial_connection.close()
         except Exception as e:
             self.logger.terminal_print(f"Error while closing serial connection: {e}")
         finally:
+            self._stop_writer(flush=False)
             self.serial_connection = None
             self.is_connected = False
             self.serial_open = False
+            self.pipeline.cancel_all(ConnectionError("Connection closed"))
+            self.reconnect.disconnected(self.com_port)
+            self.registry.flush()
             self.root.after(0, self.update_mcu_status)  # Thread-safe update
 
     def toggle_serial_printing(self, state):
-        """Enables or disables printing of serial data to the terminal."""
+        """
+        Enables or disables printing of serial data to the terminal. While off,
+        the terminal is unsubscribed from the frame bus, so frames are not even
+        decoded for it.
+
+        Console text and DEAD frames use separate subscriptions: each has its
+        own queue, and binary frames are rate limited, so heavy binary traffic
+        can neither push console replies out nor flood the terminal.
+        """
         self.print_serial_data = state
+        if state and self.console_subscription is None:
+            self.console_subscription = self.frame_bus.subscribe(
+                self._log_frame, kinds=(FRAME_KM,), maxsize=self.LOG_QUEUE_SIZE, name="terminal-console"
+            )
+            self.binary_subscription = self.frame_bus.subscribe(
+                self._log_frame, kinds=(FRAME_DEAD,), maxsize=self.LOG_QUEUE_SIZE, name="terminal-binary",
+                rate=self.BINARY_PRINT_RATE, burst=self.BINARY_PRINT_BURST
+            )
+        elif not state and self.console_subscription is not None:
+            for subscription in (self.console_subscription, self.binary_subscription):
+                subscription.close()
+            self.console_subscription = None
+            self.binary_subscription = None
+
+    def acquire_port(self, owner, release_handle=True):
+        """
+        Lends the current port to owner and returns a PortLease. The reader,
+        writer and keep-alive stop; queued frames are flushed first. With
+        release_handle the handle is closed (no DEBUG_OFF, no settle delay) so
+        an external tool such as esptool can open the port itself; otherwise
+        lease.connection stays open for the owner to use.
+        """
+        with self.connect_lock:
+            lease = PortLease(self, owner, self.com_port, self.current_mode, self.com_speed, None)
+            self.lease = lease
+        if not lease.was_connected:
+            return lease
+
+        self._stop_writer(flush=True)
+        self.pipeline.cancel_all(ConnectionError(f"Port leased to {owner}"))
+        connection = self.serial_connection
+        try:
+            connection.cancel_read()  # Unblock the reader's read(1) right away
+        except Exception:
+            pass
+        reader = self.serial_thread
+        if reader and reader.is_alive() and reader is not threading.current_thread():
+            reader.join(timeout=self.READ_TIMEOUT * 2)
+
+        if release_handle:
+            self.serial_open = False
+            self.serial_connection = None
+            try:
+                connection.close()
+            except Exception as e:
+                self.logger.terminal_print(f"Error closing serial connection: {e}")
+        else:
+            lease.connection = connection
+        return lease
+
+    def release_port(self, lease):
+        """
+        Takes the port back from a lease. A released handle is reopened on the
+        same port directly; only if that fails does the reconnect state machine
+        take over (with backoff, not a fixed sleep).
+        """
+        if self.lease is not lease:
+            return
+        if not lease.was_connected:
+            self.lease = None
+            self.monitor_wakeup.set()
+            return
+
+        connection = lease.connection
+        if connection is None:
+            try:
+                connection = serial.Serial(
+                    port=lease.com_port,
+                    baudrate=lease.baudrate,
+                    timeout=self.READ_TIMEOUT,
+                    parity=serial.PARITY_NONE,
+                    stopbits=serial.STOPBITS_ONE,
+                    bytesize=serial.EIGHTBITS
+                )
+            except Exception as e:
+                self.logger.terminal_print(f"Could not reopen {lease.com_port} after {lease.owner}: {e}")
+                self.lease = None
+                self.handle_disconnect()
+                return
+
+        with self.connect_lock:
+            self.lease = None
+            self.serial_connection = connection
+            self.serial_open = True
+            self._start_io()
+        self.logger.terminal_print(f"{lease.com_port} handed back by {lease.owner}.")
 
     def set_flashing(self, status: bool):
         """
@@ -292,93 +708,271 @@ class SerialHandler:
         Enforces a header frame of [0xDE, 0xAD],
         followed by a 16-bit payload size (LSB then MSB),
         and then the actual data payload (UTF-8 encoded if str).
-        Also logs the hex bytes being sent.
+        The frame is queued for the writer thread; this never blocks.
+        Returns False if the port is not open or the TX queue is full.
         """
-        if not self.serial_connection or not self.serial_connection.is_open:
-            self.logger.terminal_print("Attempted to write but serial is not open.")
-            return
-
-        if isinstance(data, str):
-            data = data.encode("utf-8")
-
-        # Prepare header + size + data
-        header = bytes([0xDE, 0xAD])
-        size = len(data)
-        lsb = size & 0xFF
-        msb = (size >> 8) & 0xFF
-        payload = header + bytes([lsb, msb]) + data
-
-        # Log the hex being sent
-        payload_hex = " ".join(f"{b:02X}" for b in payload)
-        #self.logger.terminal_print(f"TX (auto-size) => {payload_hex}")
-
-        try:
-            self.serial_connection.write(payload)
-        except Exception as e:
-            self.logger.terminal_print(f"Error while writing to serial: {e}")
+        return self._queue_frame(encode_frame(data))
 
     def write_to_serial_with_size(self, size, data):
         """
         Prepends 0xDE,0xAD header and the 16-bit size (LSB, MSB) before sending.
-        Does NOT log the hex bytes being sent now.
+        Queued like write_to_serial.
         """
-        if not self.serial_connection or not self.serial_connection.is_open:
-            self.logger.terminal_print("Attempted to write but serial is not open.")
-            return
-    
-        if isinstance(data, str):
-            data = data.encode("utf-8")
-    
-        header = bytes([0xDE, 0xAD])
-        lsb = size & 0xFF
-        msb = (size >> 8) & 0xFF
-        payload = header + bytes([lsb, msb]) + data
-    
-        try:
-            self.serial_connection.write(payload)
-        except Exception as e:
-            self.logger.terminal_print(f"Error while writing to serial: {e}")
-    
+        return self._queue_frame(encode_frame(data, size))
 
-    def send_command(self, command, payload=b"", callback=None):
+    def _queue_frame(self, frame):
+        """Hands an encoded frame to the writer thread without waiting for the write."""
+        writer = self.writer
+        if not writer or not self.serial_connection or not self.serial_connection.is_open:
+            self.logger.terminal_print("Attempted to write but serial is not open.")
+            return False
+        if not writer.submit(frame):
+            self.metrics.tx_rejected += 1
+            self.logger.terminal_print(f"TX queue full ({writer.depth} frames), frame dropped.")
+            return False
+        self.metrics.tx_frames += 1
+        return True
+
+    def get_metrics(self):
+        """
+        Snapshot of the current port's I/O counters, parser resyncs and dropped
+        bytes, command timeouts, RTT / read-to-dispatch latency percentiles and
+        per-channel frame bus counters and the port snapshot's age.
+        Cheap enough to call from a GUI timer.
+        """
+        snapshot = self.metrics.snapshot(self.reassembler, self.pipeline, self.writer)
+        snapshot["channels"] = self.frame_bus.stats()
+        snapshot["port_inventory"] = self.port_inventory.status()
+        snapshot["device"] = dict(self.device) if self.device else None
+        return snapshot
+
+    def tx_queue_depth(self):
+        """Number of frames waiting for the writer thread (0 when disconnected)."""
+        return self.writer.depth if self.writer else 0
+
+    def handle_write_error(self, error):
+        """Called on the writer thread when a write fails."""
+        self.logger.terminal_print(f"Error while writing to serial: {error}")
+        self.pipeline.cancel_all(error)
+
+    def _stop_writer(self, flush):
+        writer, self.writer = self.writer, None
+        if writer:
+            writer.stop(flush=flush)
+
+    def send_command(self, command, payload=b"", callback=None, timeout=None, tag=None, silent=False):
         """
         Generalized method to send a command with optional payload and an optional callback.
+        Returns a concurrent.futures.Future that receives the response (str for km.
+        commands, bytes for opcodes) or CommandTimeout. Several commands may be
+        outstanding at once; responses are matched in FIFO order, or by tag prefix.
+        With silent=True the response is not printed to the terminal.
         """
-        self.response_callback = callback  # Store the callback to call once the response is processed
+        future = self.pipeline.register(command, expected_response_kind(command), tag, timeout, silent)
+        if callback:
+            future.add_done_callback(
+                lambda f: callback(f.result()) if not f.cancelled() and f.exception() is None else None
+            )
 
-        size = len(payload) + 1  # 1 byte for the command itself
-        # Ensure command is converted to bytes
-        data = bytes(command, 'utf-8') + payload  # Convert command to bytes
-        self.write_to_serial_with_size(size, data)
+        if not self._queue_frame(encode_frame(encode_command(command, payload))):
+            self.pipeline.fail(future, ConnectionError("Command could not be queued"))
+        return future
 
-    def get_baud_rate(self):
+    def send_batch(self, commands, timeout=None):
+        """
+        Sends several commands in a single write and returns their futures in order.
+        Each entry is a command or a (command, payload) tuple. The whole batch costs
+        one round trip instead of one per command.
+        """
+        futures = []
+        payloads = []
+        for entry in commands:
+            command, payload = entry if isinstance(entry, tuple) else (entry, b"")
+            futures.append(self.pipeline.register(command, expected_response_kind(command), None, timeout))
+            payloads.append(encode_command(command, payload))
+
+        if not self._queue_frame(encode_frames(payloads)):
+            for future in futures:
+                self.pipeline.fail(future, ConnectionError("Commands could not be queued"))
+        return futures
+
+    def start_device_log(self, print_to_terminal=True):
+        """
+        Enables device logging (SET_DEV_LOG) and streams the device's DEAD frames
+        into a fixed-size ring buffer instead of printing each one. Consumers
+        (GUI, RingFileSink, analysis tools) take a reader with
+        self.device_log.reader(). Returns the ring buffer.
+        """
+        if self.device_log is None:
+            self.device_log = FrameRingBuffer(self.DEVICE_LOG_SLOTS, self.DEVICE_LOG_SLOT_SIZE)
+        self.write_to_serial(encode_command(self.SET_DEV_LOG, b"\x01"))
+        if print_to_terminal and self.device_log_reader is None:
+            self.device_log_reader = self.device_log.reader()
+            self.root.after(self.DEVICE_LOG_PRINT_INTERVAL, self._print_device_log)
+        return self.device_log
+
+    def stop_device_log(self):
+        """Disables device logging. The ring buffer stays readable until the next start."""
+        self.write_to_serial(encode_command(self.SET_DEV_LOG, b"\x00"))
+        ring, self.device_log = self.device_log, None
+        self.device_log_reader = None
+        return ring
+
+    def get_device_log_state(self, timeout=None):
+        """
+        Queries whether device logging is on (GET_DEV_LOG). Returns a future.
+        The reply is matched by its opcode, so log records streaming in at
+        the same time cannot be taken for it.
+        """
+        return self.send_command(self.GET_DEV_LOG, timeout=timeout, tag=bytes([self.GET_DEV_LOG]))
+
+    def _print_device_log(self):
+        """Runs on the Tk thread: shows a bounded batch of device log records."""
+        reader = self.device_log_reader
+        if reader is None:
+            return
+        dropped = reader.dropped
+        for record in reader.read(self.DEVICE_LOG_PRINT_BATCH):
+            self.logger.terminal_print(record.decode('utf-8', errors='ignore'))
+        if reader.dropped != dropped:
+            self.logger.terminal_print(f"[device log: {reader.dropped - dropped} lines skipped]")
+        self.root.after(self.DEVICE_LOG_PRINT_INTERVAL, self._print_device_log)
+
+    def start_capture(self, path=None):
+        """
+        Records every RX chunk and TX write of this session, timestamped, into
+        a capture file (see modules.capture). Returns the file path.
+        """
+        self.stop_capture()
+        if path is None:
+            os.makedirs(self.CAPTURE_FOLDER, exist_ok=True)
+            path = os.path.join(self.CAPTURE_FOLDER, time.strftime('serial_%Y%m%d_%H%M%S.mkcap'))
+        try:
+            self.capture = CaptureWriter(path)
+        except OSError as e:
+            self.logger.terminal_print(f"Failed to start capture: {e}")
+            return None
+        self.logger.terminal_print(f"Capturing serial traffic to {path}")
+        return path
+
+    def stop_capture(self):
+        """Stops the running capture, if any, and closes its file."""
+        capture, self.capture = self.capture, None
+        if capture:
+            capture.close()
+            self.logger.terminal_print(f"Capture saved: {capture.path} ({capture.records} records)")
+
+    def _on_tx(self, data):
+        """Runs on the writer thread after every successful write."""
+        self.metrics.note_tx(len(data))
+        capture = self.capture
+        if capture:
+            capture.record(CAPTURE_TX, data)
+
+    @staticmethod
+    def encode_baud_rate(baud_rate):
+        """SET_BAUD_RATE payload: the rate as a 32-bit little-endian integer."""
+        return struct.pack('<I', baud_rate)
+
+    def get_baud_rate(self, timeout=None):
         """
         Sends a command to retrieve the current baud rate.
+        Returns a future with the raw DEAD response payload, matched by its
+        opcode like get_device_log_state().
         """
         self.logger.terminal_print("Requesting current baud rate...")
-        self.send_command(self.GET_BAUD_RATE)
+        return self.send_command(self.GET_BAUD_RATE, timeout=timeout, tag=bytes([self.GET_BAUD_RATE]))
 
     def set_baud_rate(self, baud_rate):
         """
-        Sends a command to set the baud rate.
-        Baud rate should be provided in LSB format.
+        Switches the device and the host to baud_rate and verifies the link.
+        Falls back to the previous rate if the link is not stable.
+        Returns True if the new rate is in use. Blocks; do not call on the Tk thread.
         """
-        if baud_rate != 115200:
-            self.logger.terminal_print("Invalid baud rate. Only 115200 is supported.")
-            return
-
-        # Prepare payload for 115200 baud rate
-        payload = bytes([0x00, 0x00, 0xC2, 0x01])
-        self.send_command(self.SET_BAUD_RATE, payload=payload)
-
-        # Wait for 300ms to ensure the device switches baud rate
-        time.sleep(0.3)
-
-        # Change the baud rate on the Python side
-        if self.serial_connection and self.serial_connection.is_open:
+        if baud_rate not in self.SUPPORTED_BAUD_RATES:
+            self.logger.terminal_print(
+                f"Invalid baud rate {baud_rate}. Supported: {', '.join(map(str, self.SUPPORTED_BAUD_RATES))}"
+            )
+            return False
+        if not self.serial_connection or not self.serial_connection.is_open:
+            self.logger.terminal_print("Attempted to change baud rate but serial is not open.")
+            return False
+        if baud_rate == self.com_speed:
+            return self.probe_link()
+
+        previous = self.com_speed
+        if self._switch_baud_rate(baud_rate):
+            self.logger.terminal_print(f"Baud rate set to {baud_rate}.")
+            return True
+
+        # The device may have switched even though the link is unusable; try to
+        # talk it back down before giving up on this rate.
+        self._apply_host_baud_rate(previous)
+        if not self.probe_link():
+            self._switch_baud_rate(previous, from_rate=baud_rate)
+        self.logger.terminal_print(f"Baud rate {baud_rate} is not stable, staying at {self.com_speed}.")
+        return False
+
+    def negotiate_baud_rate(self, ladder=None):
+        """
+        Steps down the baud rate ladder (fastest first) until the link is stable,
+        and remembers the result for this device. The rate that worked last time
+        is tried first. Returns the rate in use. Blocks; run it off the Tk thread.
+        """
+        ladder = sorted(ladder or self.BAUD_LADDER, reverse=True)
+        preferred = self.device.get("baud_rate") if self.device else None
+        if preferred in ladder:
+            ladder.remove(preferred)
+            ladder.insert(0, preferred)
+
+        for rate in ladder:
+            if self.set_baud_rate(rate):
+                self.update_device_state(baud_rate=rate)
+                return rate
+        return self.com_speed
+
+    def probe_link(self, attempts=None, timeout=None, settle_attempts=0):
+        """
+        Checks the link with back-to-back km.version() probes.
+        Up to settle_attempts probes may fail while the device finishes switching;
+        after the first good reply, every one of attempts probes must succeed.
+        """
+        attempts = attempts or self.BAUD_PROBE_ATTEMPTS
+        timeout = timeout or self.BAUD_PROBE_TIMEOUT
+        good = 0
+        failures = 0
+        while good < attempts:
+            future = self.send_command('km.version()', timeout=timeout, silent=True)
             try:
-                self.serial_connection.baudrate = baud_rate
-                self.com_speed = baud_rate
-                self.logger.terminal_print(f"Baud rate set to {baud_rate}.")
-            except Exception as e:
-                self.logger.terminal_print(f"Error setting baud rate: {e}")
+                ok = future.result().startswith("km.MAKCU")
+            except Exception:
+                ok = False
+            if ok:
+                good += 1
+            elif good or failures >= settle_attempts:
+                return False
+            else:
+                failures += 1
+        return True
+
+    def _switch_baud_rate(self, baud_rate, from_rate=None):
+        """Tells the device to switch, follows on the host side and probes the link."""
+        if from_rate is not None:
+            self._apply_host_baud_rate(from_rate)
+        self.write_to_serial(encode_command(self.SET_BAUD_RATE, self.encode_baud_rate(baud_rate)))
+        # The command must be on the wire before the host changes speed
+        if self.writer:
+            self.writer.flush()
+        self.serial_connection.flush()
+        self._apply_host_baud_rate(baud_rate)
+        return self.probe_link(settle_attempts=self.BAUD_SETTLE_ATTEMPTS)
+
+    def _apply_host_baud_rate(self, baud_rate):
+        try:
+            self.serial_connection.baudrate = baud_rate
+            self.com_speed = baud_rate
+        except Exception as e:
+            self.logger.terminal_print(f"Error setting baud rate: {e}")
+        with self.lock:
+            self.reassembler.reset()  # Bytes received mid-switch are garbage
+
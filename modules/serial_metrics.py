@@ -0,0 +1,169 @@
+# modules/serial_metrics.py
+
+import threading
+import time
+from array import array
+
+
+class LatencyHistogram:
+    """
+    Log-linear latency histogram in the style of HdrHistogram.
+
+    Values are recorded in microseconds. Each power of two is split into
+    2**precision_bits linear sub-buckets, so every recorded value is kept
+    with a relative error below 1 / 2**precision_bits (about 3% by default)
+    from 1 us up to max_us, in a few hundred fixed counters. record() is O(1)
+    and allocates nothing; values above max_us land in the top bucket.
+    """
+
+    def __init__(self, max_us=60_000_000, precision_bits=5):
+        self.precision_bits = precision_bits
+        self.sub_buckets = 1 << precision_bits
+        self.max_us = max_us
+        self.counts = array('Q', [0]) * (self._index(max_us) + 1)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            for i in range(len(self.counts)):
+                self.counts[i] = 0
+            self.count = 0
+            self.total_us = 0
+            self.min_us = None
+            self.max_seen_us = 0
+
+    def _index(self, value):
+        if value < self.sub_buckets:
+            return value
+        shift = value.bit_length() - self.precision_bits - 1
+        return self.sub_buckets * (shift + 1) + (value >> shift) - self.sub_buckets
+
+    def _bucket_high(self, index):
+        """Largest value that falls into bucket index."""
+        if index < self.sub_buckets:
+            return index
+        shift, sub = divmod(index - self.sub_buckets, self.sub_buckets)
+        return ((self.sub_buckets + sub + 1) << shift) - 1
+
+    def record(self, seconds):
+        """Records one latency given in seconds."""
+        value = int(seconds * 1_000_000)
+        if value < 0:
+            value = 0
+        index = self._index(min(value, self.max_us))
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_us += value
+            if self.min_us is None or value < self.min_us:
+                self.min_us = value
+            if value > self.max_seen_us:
+                self.max_seen_us = value
+
+    def percentile(self, p):
+        """Value in microseconds at or below which p percent of samples fall."""
+        with self.lock:
+            if not self.count:
+                return None
+            target = max(1, -(-self.count * p // 100))  # ceil
+            seen = 0
+            for index, n in enumerate(self.counts):
+                seen += n
+                if seen >= target:
+                    return min(self._bucket_high(index), self.max_seen_us)
+        return self.max_seen_us
+
+    def snapshot(self):
+        """Summary in microseconds: count, min, mean, p50, p90, p99, p99.9, max."""
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "min_us": self.min_us,
+            "mean_us": self.total_us / self.count,
+            "p50_us": self.percentile(50),
+            "p90_us": self.percentile(90),
+            "p99_us": self.percentile(99),
+            "p999_us": self.percentile(99.9),
+            "max_us": self.max_seen_us,
+        }
+
+
+class SerialMetrics:
+    """
+    Counters and latency histograms for one serial port.
+
+    Counters are plain integers bumped by the thread that owns that direction
+    (the reader for RX, the writer for TX), so updating them costs no lock.
+    snapshot() gathers everything into a dict that the GUI, the log or an
+    exporter can read at any rate.
+    """
+
+    def __init__(self, com_port=""):
+        self.com_port = com_port
+        self.command_rtt = LatencyHistogram()       # Command queued -> response matched
+        self.dispatch_latency = LatencyHistogram()  # read() returned -> frame dispatched
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.monotonic()
+        self.rx_bytes = 0
+        self.rx_reads = 0
+        self.rx_frames = {}     # kind -> count
+        self.tx_bytes = 0
+        self.tx_writes = 0
+        self.tx_frames = 0
+        self.tx_rejected = 0    # Frames refused because the TX queue was full
+        self.connects = 0
+        self.disconnects = 0
+        self.command_rtt.reset()
+        self.dispatch_latency.reset()
+
+    def note_rx(self, size):
+        self.rx_reads += 1
+        self.rx_bytes += size
+
+    def note_frame(self, kind):
+        self.rx_frames[kind] = self.rx_frames.get(kind, 0) + 1
+
+    def note_tx(self, size):
+        self.tx_writes += 1
+        self.tx_bytes += size
+
+    @property
+    def reconnects(self):
+        return max(self.connects - 1, 0)
+
+    def snapshot(self, reassembler=None, pipeline=None, writer=None):
+        """
+        Returns every counter and histogram summary as a plain dict. Pass the
+        port's reassembler, pipeline and writer to include parser resyncs,
+        dropped bytes, command timeouts and the TX queue depth.
+        """
+        snapshot = {
+            "com_port": self.com_port,
+            "uptime": time.monotonic() - self.started_at,
+            "rx_bytes": self.rx_bytes,
+            "rx_reads": self.rx_reads,
+            "rx_frames": dict(self.rx_frames),
+            "tx_bytes": self.tx_bytes,
+            "tx_writes": self.tx_writes,
+            "tx_frames": self.tx_frames,
+            "tx_rejected": self.tx_rejected,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "disconnects": self.disconnects,
+            "command_rtt": self.command_rtt.snapshot(),
+            "dispatch_latency": self.dispatch_latency.snapshot(),
+        }
+        if reassembler is not None:
+            snapshot["resyncs"] = reassembler.resyncs
+            snapshot["dropped_bytes"] = reassembler.dropped_bytes
+        if pipeline is not None:
+            snapshot["command_timeouts"] = pipeline.timeouts
+            snapshot["commands_pending"] = pipeline.pending_count
+        if writer is not None:
+            snapshot["tx_queue_depth"] = writer.depth
+            snapshot["tx_queue_max_depth"] = writer.max_depth
+        return snapshot
@@ -0,0 +1,118 @@
+# modules/serial_writer.py
+
+import queue
+import threading
+
+
+class SerialWriter:
+    """
+    Dedicated TX thread for one serial connection.
+
+    Callers hand finished frames to submit(), which returns immediately. The
+    writer thread drains the bounded queue and joins whatever is waiting (up
+    to max_coalesce bytes) into a single write() call, so bursts of small
+    frames cost one USB transfer instead of many.
+
+    When the queue is full, submit() either rejects the frame (block=False)
+    or waits up to timeout for room, which is how backpressure reaches
+    producers. Write errors are reported through on_error(exc) on the writer
+    thread; on_write(data), if set, sees every chunk that reached the port.
+    """
+
+    def __init__(self, connection, max_queue=256, max_coalesce=4096, on_error=None, on_write=None):
+        self.connection = connection
+        self.max_coalesce = max_coalesce
+        self.on_error = on_error
+        self.on_write = on_write
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.running = False
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.writes = 0        # write() calls; frames_written / writes = coalescing ratio
+        self.rejected = 0      # Frames refused because the queue was full
+        self.max_depth = 0     # High-water mark of the queue
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self, flush=True, timeout=2.0):
+        """Stops the writer. With flush, frames already queued are written first."""
+        if not self.running:
+            return
+        if flush and self.thread is not threading.current_thread():
+            self.flush(timeout)
+        self.running = False
+        try:
+            self.queue.put_nowait(None)  # Wake the thread
+        except queue.Full:
+            pass
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=timeout)
+
+    def submit(self, frame, block=False, timeout=None):
+        """
+        Queues one encoded frame. Returns False if the writer is stopped or
+        the queue stayed full.
+        """
+        if not self.running:
+            return False
+        try:
+            self.queue.put(frame, block=block, timeout=timeout)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def flush(self, timeout=2.0):
+        """Waits until every queued frame was written. Returns False on timeout."""
+        done = threading.Event()
+        if not self.submit(done, block=True, timeout=timeout):
+            return False
+        return done.wait(timeout)
+
+    @property
+    def depth(self):
+        """Number of frames waiting to be written."""
+        return self.queue.qsize()
+
+    def _run(self):
+        while self.running:
+            item = self.queue.get()
+            batch = []
+            size = 0
+            markers = []
+            while item is not None:
+                if isinstance(item, threading.Event):
+                    markers.append(item)  # flush() marker: everything before it is in batch
+                else:
+                    batch.append(item)
+                    size += len(item)
+                if size >= self.max_coalesce:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                data = batch[0] if len(batch) == 1 else b"".join(batch)
+                try:
+                    self.connection.write(data)
+                    self.writes += 1
+                    self.frames_written += len(batch)
+                    self.bytes_written += len(data)
+                    if self.on_write:
+                        self.on_write(data)
+                except Exception as e:
+                    if self.on_error:
+                        self.on_error(e)
+            for marker in markers:
+                marker.set()